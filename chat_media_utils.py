@@ -28,12 +28,15 @@ import json
 import logging
 import os
 import re
+import shutil
 import subprocess
 import sys
 import tempfile
 from datetime import datetime, timezone
 from pathlib import Path
 
+import snap_utils
+
 CREATE_NO_WINDOW = 0x08000000 if sys.platform == 'win32' else 0
 
 try:
@@ -202,8 +205,7 @@ def build_chat_index(json_dir):
     chat_path = os.path.join(json_dir, 'chat_history.json')
     if os.path.exists(chat_path):
         try:
-            with open(chat_path, encoding='utf-8') as f:
-                conversations = json.load(f)
+            conversations = snap_utils.load_json(chat_path)
             for conv_key, messages in conversations.items():
                 for msg in messages:
                     ids = [i.strip() for i in (msg.get('Media IDs') or '').split('|')
@@ -227,8 +229,7 @@ def build_chat_index(json_dir):
     snap_path = os.path.join(json_dir, 'snap_history.json')
     if os.path.exists(snap_path):
         try:
-            with open(snap_path, encoding='utf-8') as f:
-                snap_data = json.load(f)
+            snap_data = snap_utils.load_json(snap_path)
             for sender_key, entries in snap_data.items():
                 for entry in entries:
                     entry['_dt'] = _msg_datetime(entry)
@@ -624,7 +625,6 @@ def pair_overlays(kinds, log_fn=None):
                         f"{best_media['fname'][:40]}…")
         finally:
             try:
-                import shutil
                 shutil.rmtree(tmp_dir)
             except Exception:
                 pass
@@ -1,33 +1,19 @@
-import json
+import importlib.util
 import os
-import requests
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import platform
 import subprocess
-import shutil
 import threading
 from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
-import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import logging
-import zipfile
-import tempfile
 import re
 import webbrowser
 import sys
 
-# For PIL and piexif: detect availability separately
 HAS_PIEXIF = False
-HAS_PIL = False
-try:
-    # Try to import PIL.Image independently so we can use it even if piexif is missing
-    from PIL import Image as PILImage
-    HAS_PIL = True
-except Exception:
-    HAS_PIL = False
-
 try:
     # piexif is optional and required only for writing EXIF
     from PIL import Image
@@ -37,26 +23,12 @@ try:
 except Exception:
     HAS_PIEXIF = False
 
-# For setting video metadata without ffmpeg
-try:
-    from mutagen.mp4 import MP4
-    HAS_MUTAGEN = True
-except ImportError:
-    HAS_MUTAGEN = False
-
-# For video conversion (HEVC to H.264)
-try:
-    import av
-    HAS_PYAV = True
-except ImportError:
-    HAS_PYAV = False
-
-# For VLC-based video conversion
-try:
-    import vlc
-    HAS_VLC = True
-except (ImportError, FileNotFoundError, OSError):
-    HAS_VLC = False
+# mutagen (video metadata without ffmpeg), PyAV (HEVC to H.264) and
+# python-vlc are only located here; video_utils imports them on first use,
+# so the window comes up without loading libav or libVLC.
+HAS_MUTAGEN = importlib.util.find_spec('mutagen') is not None
+HAS_PYAV = importlib.util.find_spec('av') is not None
+HAS_VLC = importlib.util.find_spec('vlc') is not None
 
 def get_app_base_dir():
     """Base directory for default output and the debug log.
@@ -165,9 +137,11 @@ def merge_images(main_img_path, overlay_img_path, output_path):
     """Merge overlay image on top of main image and save to output_path. Delegates to zip_utils."""
     return zip_utils.merge_images(main_img_path, overlay_img_path, output_path)
 
-def merge_video_overlay(main_video_path, overlay_image_path, output_path):
+def merge_video_overlay(main_video_path, overlay_image_path, output_path,
+                        date_obj=None, latitude=None, longitude=None, timezone_offset=None):
     """Overlay an image on top of a video using ffmpeg. Delegates to zip_utils."""
-    return zip_utils.merge_video_overlay(main_video_path, overlay_image_path, output_path)
+    return zip_utils.merge_video_overlay(main_video_path, overlay_image_path, output_path,
+                                         date_obj, latitude, longitude, timezone_offset)
 
 def process_zip_overlay(zip_path, output_dir, date_obj=None):
     """Process ZIP overlay files. Delegates to zip_utils."""
@@ -187,581 +161,6 @@ def get_file_extension(media_type):
 
 
 # ==================== GUI Application ====================
-    """Merge overlay image on top of main image and save to output_path.
-
-    - Resizes overlay to match main if sizes differ.
-    - Preserves alpha channel if present by converting to RGBA.
-    """
-    if not HAS_PIL:
-        logging.error("Pillow is not installed; cannot merge images")
-        return False, "Pillow not installed"
-
-    try:
-        main = PILImage.open(main_img_path).convert('RGBA')
-        overlay = PILImage.open(overlay_img_path).convert('RGBA')
-
-        if overlay.size != main.size:
-            overlay = overlay.resize(main.size, PILImage.LANCZOS)
-
-        merged = PILImage.alpha_composite(main, overlay)
-
-        # Determine output format from output_path extension
-        ext = Path(output_path).suffix.lower()
-        if ext in ['.jpg', '.jpeg']:
-            # JPEG doesn't support alpha; flatten against white background
-            bg = PILImage.new('RGB', merged.size, (255, 255, 255))
-            bg.paste(merged, mask=merged.split()[3])
-            bg.save(output_path, quality=95)
-        else:
-            # PNG or other formats supporting alpha
-            merged.save(output_path)
-
-        return True, output_path
-
-    except Exception as e:
-        logging.error(f"Error merging images: {e}", exc_info=True)
-        return False, str(e)
-
-
-def merge_video_overlay(main_video_path, overlay_image_path, output_path):
-    """Overlay an image (caption) on top of a video using ffmpeg.
-    
-    CRITICAL FIX: Uses loop filter to repeat the overlay image for the entire video duration.
-    Without this, ffmpeg takes the duration of the shortest input (1 second for a static image),
-    resulting in a 1-second output video.
-
-    Returns (True, output_path) on success or (False, error_message).
-    """
-    try:
-        if not check_ffmpeg():
-            logging.warning("ffmpeg not found; cannot merge video overlay")
-            return False, "ffmpeg not found"
-
-        # First, get the duration of the main video to know how long to loop the overlay
-        try:
-            probe_cmd = [
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(main_video_path)
-            ]
-            probe_result = subprocess.run(
-                probe_cmd, capture_output=True, text=True, 
-                timeout=10, creationflags=CREATE_NO_WINDOW
-            )
-            video_duration = float(probe_result.stdout.strip())
-            logging.info(f"Main video duration: {video_duration} seconds")
-        except Exception as probe_error:
-            logging.warning(f"Could not determine video duration, using default loop: {probe_error}")
-            video_duration = None
-
-        # Build ffmpeg command with proper overlay looping
-        # Using loop filter ensures the overlay image repeats for entire video duration
-        # shortest=0 ensures output duration matches the main video, not the overlay
-        cmd = [
-            'ffmpeg', '-y',
-            '-stream_loop', '-1',  # Loop the overlay image indefinitely
-            '-i', str(overlay_image_path),
-            '-i', str(main_video_path),
-            '-filter_complex', '[0:v]loop=loop=-1:size=1:start=0[overlay];[1:v][overlay]overlay=0:0:shortest=1[outv]',
-            '-map', '[outv]',
-            '-map', '1:a?',  # Copy audio from main video if it exists
-            '-c:a', 'copy',
-            '-c:v', 'libx264', '-crf', '18', '-preset', 'veryfast',
-            str(output_path)
-        ]
-
-        logging.info(f"Running ffmpeg to merge video overlay: {' '.join(cmd)}")
-        logging.info(f"Input video: {main_video_path}")
-        logging.info(f"Overlay image: {overlay_image_path}")
-        logging.info(f"Output path: {output_path}")
-        
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
-        
-        if proc.returncode != 0:
-            logging.error(f"ffmpeg overlay merge failed with return code {proc.returncode}")
-            logging.error(f"ffmpeg stderr: {proc.stderr}")
-            logging.error(f"ffmpeg stdout: {proc.stdout}")
-            return False, proc.stderr
-
-        # Verify output exists and has reasonable size
-        if os.path.exists(output_path):
-            output_size = os.path.getsize(output_path)
-            logging.info(f"Merged video created: {output_path} ({output_size} bytes)")
-            
-            if output_size > 1000:
-                # Additional verification: check duration of output video
-                try:
-                    verify_cmd = [
-                        'ffprobe', '-v', 'error',
-                        '-show_entries', 'format=duration',
-                        '-of', 'default=noprint_wrappers=1:nokey=1',
-                        str(output_path)
-                    ]
-                    verify_result = subprocess.run(
-                        verify_cmd, capture_output=True, text=True,
-                        timeout=10, creationflags=CREATE_NO_WINDOW
-                    )
-                    output_duration = float(verify_result.stdout.strip())
-                    logging.info(f"Output video duration: {output_duration} seconds")
-                    
-                    if video_duration and output_duration < (video_duration * 0.9):
-                        logging.warning(
-                            f"Output duration ({output_duration}s) is significantly shorter "
-                            f"than input ({video_duration}s) - possible merge issue"
-                        )
-                except Exception as verify_error:
-                    logging.debug(f"Could not verify output duration: {verify_error}")
-                
-                return True, str(output_path)
-            else:
-                logging.error(f"Output file too small: {output_size} bytes")
-                return False, f"ffmpeg produced file that is too small ({output_size} bytes)"
-        else:
-            logging.error("ffmpeg did not produce output file")
-            return False, "ffmpeg did not produce output file"
-            
-    except subprocess.TimeoutExpired:
-        logging.error("ffmpeg overlay merge timed out after 300 seconds")
-        return False, "ffmpeg timeout"
-    except Exception as e:
-        logging.error(f"Error merging video overlay: {e}", exc_info=True)
-        return False, str(e)
-
-
-def process_zip_overlay(zip_path, output_dir, date_obj=None):
-    """Extract ZIP to a temp directory, find -main/-overlay pairs, merge them, and save -merged files to output_dir.
-
-    Args:
-        zip_path: Path to the ZIP file
-        output_dir: Directory to save merged files
-        date_obj: Optional datetime object from memories_history.json for accurate filenames
-
-    Returns a list of merged file paths.
-    """
-    merged_files = []
-    temp_dir = None
-    try:
-        logging.info(f"Processing ZIP for overlays: {zip_path}")
-        temp_dir = Path(tempfile.mkdtemp(prefix="zip_extract_"))
-
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            # Inspect zip member names (this looks deep into nested folders)
-            namelist = [n for n in z.namelist() if not n.endswith('/')]
-            z.extractall(temp_dir)
-
-            # Build map by base name from zip members (ignore differing extensions)
-            pattern_main = re.compile(r'(?P<base>.+)-main(?P<ext>\.[^.]+)$', re.IGNORECASE)
-            pattern_overlay = re.compile(r'(?P<base>.+)-overlay(?P<ext>\.[^.]+)$', re.IGNORECASE)
-
-            # Map basenames to lists of files: {base: {"main": path, "overlay": path}}
-            pairs = {}
-            for member_name in namelist:
-                m_main = pattern_main.search(member_name)
-                m_overlay = pattern_overlay.search(member_name)
-
-                if m_main:
-                    base = m_main.group('base')
-                    if base not in pairs:
-                        pairs[base] = {}
-                    pairs[base]['main'] = member_name
-                elif m_overlay:
-                    base = m_overlay.group('base')
-                    if base not in pairs:
-                        pairs[base] = {}
-                    pairs[base]['overlay'] = member_name
-
-        # Now merge pairs
-        for base, files in pairs.items():
-            main_file = files.get('main')
-            overlay_file = files.get('overlay')
-
-            # Only merge if we have both
-            if not main_file or not overlay_file:
-                continue
-
-            main_path = temp_dir / main_file
-            overlay_path = temp_dir / overlay_file
-
-            # Determine type and merge
-            # For images: use merge_images
-            # For videos: use merge_video_overlay
-            ext = Path(main_file).suffix.lower()
-            is_video = ext in ['.mp4', '.mov', '.m4v', '.avi', '.mkv']
-
-            # Build output name: replace -main with -merged
-            output_name = Path(main_file).name.replace('-main', '-merged')
-            output_path = Path(output_dir) / output_name
-
-            if is_video:
-                success, result = merge_video_overlay(str(main_path), str(overlay_path), str(output_path))
-                if success:
-                    # Rename merged file to standard date/time format and remove originals
-                    try:
-                        # Use date from memories_history.json if available, otherwise use file modification time
-                        if date_obj:
-                            ts = date_obj
-                        else:
-                            try:
-                                ts = datetime.fromtimestamp(main_path.stat().st_mtime)
-                            except Exception:
-                                ts = datetime.now()
-                        date_name = ts.strftime("%Y%m%d_%H%M%S")
-                        new_name = f"{date_name}{output_path.suffix}"
-                        new_path = Path(output_dir) / new_name
-
-                        # Ensure uniqueness
-                        count = 1
-                        while new_path.exists():
-                            new_path = Path(output_dir) / f"{date_name}_{count}{output_path.suffix}"
-                            count += 1
-
-                        os.rename(output_path, new_path)
-                        merged_files.append(str(new_path))
-                        logging.info(f"Merged video: {new_path}")
-
-                        # Try to remove the original files if present in output dir (safety) or temp dir
-                        try:
-                            orig_in_out = Path(output_dir) / Path(main_file).name
-                            if orig_in_out.exists() and orig_in_out != new_path:
-                                os.remove(orig_in_out)
-                                logging.info(f"Removed original main file from output dir: {orig_in_out}")
-                        except Exception as rm_err:
-                            logging.debug(f"Could not remove original main in output dir: {rm_err}")
-
-                        try:
-                            # main_path and overlay_path are in temp dir; attempt removal
-                            if main_path.exists():
-                                main_path.unlink()
-                            if overlay_path.exists():
-                                overlay_path.unlink()
-                        except Exception:
-                            pass
-
-                    except Exception as rename_err:
-                        logging.warning(f"Merged but could not rename video {base}: {rename_err}")
-                        merged_files.append(str(output_path))
-                else:
-                    logging.warning(f"Failed to merge video {base}: {result}")
-            else:
-                # Image
-                success, result = merge_images(str(main_path), str(overlay_path), str(output_path))
-                if success:
-                    try:
-                        # Use date from memories_history.json if available, otherwise use file modification time
-                        if date_obj:
-                            ts = date_obj
-                        else:
-                            try:
-                                ts = datetime.fromtimestamp(main_path.stat().st_mtime)
-                            except Exception:
-                                ts = datetime.now()
-                        date_name = ts.strftime("%Y%m%d_%H%M%S")
-                        new_name = f"{date_name}{output_path.suffix}"
-                        new_path = Path(output_dir) / new_name
-
-                        # Ensure uniqueness
-                        count = 1
-                        while new_path.exists():
-                            new_path = Path(output_dir) / f"{date_name}_{count}{output_path.suffix}"
-                            count += 1
-
-                        os.rename(output_path, new_path)
-                        merged_files.append(str(new_path))
-                        logging.info(f"Merged image: {new_path}")
-
-                        # Remove originals if present in output dir and temp dir
-                        try:
-                            orig_in_out = Path(output_dir) / Path(main_file).name
-                            if orig_in_out.exists() and orig_in_out != new_path:
-                                os.remove(orig_in_out)
-                                logging.info(f"Removed original main file from output dir: {orig_in_out}")
-                        except Exception as rm_err:
-                            logging.debug(f"Could not remove original main in output dir: {rm_err}")
-
-                        try:
-                            if main_path.exists():
-                                main_path.unlink()
-                            if overlay_path.exists():
-                                overlay_path.unlink()
-                        except Exception:
-                            pass
-
-                    except Exception as rename_err:
-                        logging.warning(f"Merged but could not rename image {base}: {rename_err}")
-                        merged_files.append(str(output_path))
-                else:
-                    logging.warning(f"Failed to merge image {base}: {result}")
-
-        return merged_files
-
-    except Exception as e:
-        logging.error(f"Error processing ZIP overlays: {e}", exc_info=True)
-        return []
-    finally:
-        # Clean up temp directory
-        if temp_dir and temp_dir.exists():
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as cleanup_error:
-                logging.debug(f"Could not clean up temp directory: {cleanup_error}")
-
-
-def download_media(url, output_path, max_retries=3, progress_callback=None, date_obj=None, merge_overlay=True):
-    """Download media file from URL with retry mechanism and optional progress callback.
-
-    Args:
-        url: URL to download from
-        output_path: Path to save the downloaded file
-        max_retries: Number of download attempts
-        progress_callback: Optional callback function for progress updates
-        date_obj: Optional datetime object from memories_history.json for accurate filenames
-        merge_overlay: Whether to merge snap overlay/caption onto media (default True)
-
-    Returns (True, None) on success, (False, None) on failure, or (True, [merged_files]) if ZIP overlay was processed.
-    """
-    last_error = None
-
-    for attempt in range(max_retries):
-        try:
-            # Exponential backoff for retries
-            if attempt > 0:
-                wait_time = 2 ** attempt
-                msg = f"Retry attempt {attempt + 1}/{max_retries} after {wait_time}s wait..."
-                logging.info(msg)
-                if progress_callback:
-                    progress_callback(msg)
-                time.sleep(wait_time)
-            else:
-                if progress_callback:
-                    progress_callback(f"Attempting download (1/{max_retries})")
-
-            response = requests.get(url, stream=True, timeout=60)
-            response.raise_for_status()
-
-            iterator = response.iter_content(chunk_size=8192)
-            try:
-                first_chunk = next(iterator)
-            except StopIteration:
-                last_error = Exception("No content in response")
-                if progress_callback:
-                    progress_callback("No content returned by server")
-                continue
-
-            magic = first_chunk[:32]
-
-            # Detect HTML error pages
-            is_html = (magic[:5].lower() == b'<!doc' or
-                       magic[:5].lower() == b'<html' or
-                       b'<html' in magic.lower() or
-                       b'<!doctype' in magic.lower())
-            if is_html:
-                last_error = Exception("HTML page instead of media file")
-                if progress_callback:
-                    progress_callback("Downloaded content is HTML (likely an error page), will retry if possible")
-                continue
-
-            # If ZIP, write directly to .zip target to avoid rename races
-            is_valid_zip = magic[:4] == b'PK\x03\x04'
-            if is_valid_zip:
-                zip_path = str(output_path) + ".zip"
-                write_path = zip_path
-            else:
-                write_path = output_path
-
-            # Write the first chunk and remaining content
-            try:
-                with open(write_path, 'wb') as fd:
-                    fd.write(first_chunk)
-                    for chunk in iterator:
-                        if chunk:
-                            fd.write(chunk)
-            except Exception as write_err:
-                last_error = write_err
-                logging.warning(f"Failed writing downloaded file to {write_path}: {write_err}")
-                try:
-                    if os.path.exists(write_path):
-                        os.remove(write_path)
-                except Exception:
-                    pass
-                continue
-
-            # If we downloaded a ZIP, try to process it
-            if is_valid_zip:
-                try:
-                    if progress_callback:
-                        progress_callback("Downloaded ZIP archive, processing...")
-                    merged = process_zip_overlay(write_path, str(Path(output_path).parent), date_obj)
-                    if merged:
-                        try:
-                            os.remove(write_path)
-                        except Exception:
-                            pass
-                        logging.info(f"Created merged images: {merged}")
-                        return (True, merged)
-                    # Fallback: extract first media file from ZIP into output_path
-                    if extract_media_from_zip(write_path, output_path):
-                        try:
-                            os.remove(write_path)
-                        except Exception:
-                            pass
-                        # Validate the extracted file below using output_path
-                        final_path = output_path
-                    else:
-                        logging.warning(f"Could not extract media from ZIP: {write_path}")
-                        final_path = write_path
-                except Exception as zip_err:
-                    logging.warning(f"Error handling ZIP file: {zip_err}")
-                    final_path = write_path
-            else:
-                final_path = write_path
-
-            # Final validations on the file we will use
-            if not os.path.exists(final_path):
-                last_error = Exception(f"Downloaded file missing: {final_path}")
-                logging.warning(str(last_error))
-                if progress_callback:
-                    progress_callback(str(last_error))
-                continue
-
-            file_size = os.path.getsize(final_path)
-            if file_size < 100:
-                logging.warning(f"Downloaded file too small ({file_size} bytes), attempt {attempt + 1}/{max_retries}")
-                try:
-                    os.remove(final_path)
-                except Exception:
-                    pass
-                last_error = Exception("File too small")
-                if progress_callback:
-                    progress_callback(f"Downloaded file too small ({file_size} bytes), will retry if possible")
-                continue
-
-            # Success
-            msg = f"Successfully downloaded file ({file_size} bytes)"
-            logging.info(msg)
-            if progress_callback:
-                progress_callback(msg)
-            return (True, None)
-
-        except requests.exceptions.RequestException as req_err:
-            last_error = req_err
-            logging.warning(f"Download attempt {attempt + 1}/{max_retries} failed: {req_err}")
-            if progress_callback:
-                progress_callback(f"Download attempt {attempt + 1}/{max_retries} failed: {req_err}")
-            # Clean up possible partial files
-            try:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-            except Exception:
-                pass
-            continue
-        except Exception as err:
-            last_error = err
-            logging.error(f"Unexpected error during download attempt {attempt + 1}/{max_retries}: {err}", exc_info=True)
-            if progress_callback:
-                progress_callback(f"Unexpected error during download attempt {attempt + 1}/{max_retries}: {err}")
-            try:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-            except Exception:
-                pass
-            continue
-
-    # Exhausted retries
-    logging.error(f"Download failed after {max_retries} attempts. Last error: {last_error}")
-    if progress_callback:
-        progress_callback(f"Download failed after {max_retries} attempts. Last error: {last_error}")
-    return (False, None)
-
-
-def validate_downloaded_file(file_path):
-    """Validate the downloaded file to ensure it is complete and not corrupted."""
-    try:
-        logging.info(f"Validating downloaded file: {file_path}")
-
-        # Check if file exists
-        if not os.path.exists(file_path):
-            logging.error(f"File does not exist: {file_path}")
-            return False
-
-        # Check file size
-        file_size = os.path.getsize(file_path)
-        if file_size < 100:  # Arbitrary minimum size for a valid file
-            logging.error(f"File is too small to be valid: {file_size} bytes")
-            return False
-
-        # Read the first few bytes to check for valid magic numbers
-        with open(file_path, 'rb') as f:
-            magic = f.read(32)
-
-        # Check for valid image formats
-        is_valid_jpg = magic[:2] == b'\xff\xd8' or magic[:3] == b'\xff\xd8\xff'
-        is_valid_png = magic[:8] == b'\x89PNG\r\n\x1a\n'
-
-        # Check for valid video formats (MP4, MOV, M4V)
-        is_valid_mp4 = (
-            len(magic) >= 12 and 
-            (magic[4:8] == b'ftyp' or  # Standard MP4
-             magic[4:8] == b'mdat' or  # Media data
-             magic[4:8] == b'moov' or  # Movie atom
-             magic[4:8] == b'wide')    # Wide atom
-        )
-        
-        # Check for ZIP file (some Snapchat exports use ZIP)
-        is_valid_zip = magic[:4] == b'PK\x03\x04'
-
-        # If the file doesn't match expected formats, it might be corrupted
-        if not (is_valid_jpg or is_valid_png or is_valid_mp4 or is_valid_zip):
-            magic_hex = magic[:8].hex()
-            logging.error(f"File format is not recognized or is corrupted (magic: {magic_hex}).")
-            return False
-
-        logging.info("File validation successful.")
-        return True
-
-    except Exception as e:
-        logging.error(f"Error during file validation: {e}", exc_info=True)
-        return False
-
-def get_file_extension(media_type):
-    """Determine file extension based on media type."""
-    if media_type == "Image":
-        return ".jpg"
-    elif media_type == "Video":
-        return ".mp4"
-    else:
-        return ".bin"
-
-# ==================== GUI Application ====================
-
-# --- Wrappers to refactored modules (override long original implementations) ---
-def extract_media_from_zip(zip_path, output_path):
-    return zip_utils.extract_media_from_zip(zip_path, output_path)
-
-
-def process_zip_overlay(zip_path, output_dir, date_obj=None):
-    return zip_utils.process_zip_overlay(zip_path, output_dir, date_obj)
-
-
-def merge_images(main_img_path, overlay_img_path, output_path):
-    return zip_utils.merge_images(main_img_path, overlay_img_path, output_path)
-
-
-def merge_video_overlay(main_video_path, overlay_image_path, output_path):
-    return zip_utils.merge_video_overlay(main_video_path, overlay_image_path, output_path)
-
-
-def download_media(url, output_path, max_retries=3, progress_callback=None, date_obj=None, merge_overlay=True):
-    return downloader.download_media(url, output_path, max_retries, progress_callback, date_obj, merge_overlay)
-
-
-def validate_downloaded_file(file_path):
-    return snap_utils.validate_downloaded_file(file_path)
-
-
-def get_file_extension(media_type):
-    return snap_utils.get_file_extension(media_type)
-
 
 class ScrollableFrame(ttk.Frame):
     """A scrollable frame that allows vertical scrolling of its content."""
@@ -2138,8 +1537,27 @@ class SnapchatDownloaderGUI:
                         # Convert all videos to H.264 by default
                         log_local("  🔄 Converting to H.264...")
 
+                        # Preferred: one ffmpeg pass that converts/rotates and writes
+                        # metadata together, instead of rewriting the file per step
+                        pipeline_done = False
+                        if check_ffmpeg():
+                            try:
+                                ok, result = video_utils.process_video_pipeline(
+                                    str(file_path), date_obj_local, latitude, longitude, tz_offset
+                                )
+                                if ok:
+                                    pipeline_done = True
+                                    log_local(f"  ✓ Converted to H.264 and set video metadata (ffmpeg, {result})")
+                                    set_file_timestamps(str(file_path), date_obj_local)
+                                else:
+                                    logging.debug(f"Single-pass video pipeline failed, using step-by-step path: {result}")
+                            except Exception as pipeline_error:
+                                logging.debug(f"Single-pass video pipeline error: {pipeline_error}")
+
                         # Check if any conversion tool is available
-                        if not HAS_PYAV and not find_vlc_executable() and not HAS_VLC:
+                        if pipeline_done:
+                            pass
+                        elif not HAS_PYAV and not find_vlc_executable() and not HAS_VLC:
                             log_local("  ⚠ No conversion tools available - keeping original format")
                             log_local("  ℹ Install PyAV (pip install av) or VLC for automatic H.264 conversion")
                             # Still count as success - video was downloaded
@@ -2155,8 +1573,9 @@ class SnapchatDownloaderGUI:
                                     log_local("  ✓ Converted to H.264")
                                     # Replace original with converted file
                                     try:
-                                        os.remove(str(file_path))
-                                        os.rename(result, str(file_path))
+                                        # Already-H.264 inputs come back unchanged as the same path
+                                        if Path(result) != Path(file_path):
+                                            os.replace(result, str(file_path))
                                         # CRITICAL: Set timestamps AFTER file replacement
                                         set_file_timestamps(str(file_path), date_obj_local)
                                         log_local("  ✓ Set file timestamps")
@@ -2175,15 +1594,16 @@ class SnapchatDownloaderGUI:
                                 set_file_timestamps(str(file_path), date_obj_local)
 
                         # Try to set video metadata - use ffmpeg first for better compatibility, then mutagen
-                        metadata_set = False
+                        metadata_set = pipeline_done
 
                         # Try ffmpeg first (sets standard creation_time metadata)
-                        try:
-                            if set_video_metadata_ffmpeg(str(file_path), date_obj_local, latitude, longitude, tz_offset):
-                                log_local("  ✓ Set video metadata (ffmpeg)")
-                                metadata_set = True
-                        except Exception as ffmpeg_error:
-                            logging.debug(f"ffmpeg metadata setting failed: {ffmpeg_error}")
+                        if not metadata_set:
+                            try:
+                                if set_video_metadata_ffmpeg(str(file_path), date_obj_local, latitude, longitude, tz_offset):
+                                    log_local("  ✓ Set video metadata (ffmpeg)")
+                                    metadata_set = True
+                            except Exception as ffmpeg_error:
+                                logging.debug(f"ffmpeg metadata setting failed: {ffmpeg_error}")
 
                         # Fall back to mutagen if ffmpeg didn't work
                         if not metadata_set and HAS_MUTAGEN:
@@ -2210,6 +1630,12 @@ class SnapchatDownloaderGUI:
                         if not validate_downloaded_file(str(file_path)):
                             log_local("  ⚠ Downloaded file is corrupted or incomplete")
                             return logs, False, True
+                        # A truncated video still has valid magic bytes; the box
+                        # walk catches a missing moov without spawning ffprobe
+                        if (media_type == "Video" and extension.lower() in ['.mp4', '.mov']
+                                and not video_utils.validate_video_file(file_path, min_size=100, quick=True)[0]):
+                            log_local("  ⚠ Downloaded video is incomplete (MP4 structure is damaged)")
+                            return logs, False, True
                     except Exception as validation_error:
                         log_local(f"  ⚠ Validation error: {validation_error}")
 
@@ -2297,8 +1723,7 @@ class SnapchatDownloaderGUI:
             
             # Load JSON
             self.log(f"Loading JSON from: {json_file}")
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = snap_utils.load_json(json_file)
             
             # Get media items
             media_items = data.get("Saved Media", [])
@@ -2571,8 +1996,7 @@ class SnapchatDownloaderGUI:
             output_path.mkdir(exist_ok=True)
 
             self.log(f"Loading JSON: {json_file}")
-            with open(json_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = snap_utils.load_json(json_file)
             json_items = data.get("Saved Media", [])
             self.log(f"JSON contains {len(json_items):,} total entries")
 
@@ -3093,7 +2517,7 @@ class SnapchatDownloaderGUI:
                 unmatched_dir.mkdir(exist_ok=True)
                 for ov in unmatched_overlays:
                     try:
-                        shutil.copy2(ov["path"], unmatched_dir / ov["fname"])
+                        snap_utils.clone_file(ov["path"], unmatched_dir / ov["fname"])
                     except Exception:
                         pass
                 self.log(f"\nℹ {len(unmatched_overlays)} caption overlay(s) could not be "
@@ -3156,14 +2580,20 @@ class SnapchatDownloaderGUI:
 
             if overlay_path and overlay_mode in ("merge", "both"):
                 if is_video:
-                    ok, result = merge_video_overlay(record["path"], overlay_path, out_file)
+                    # Tags are written by the merge itself; no second remux
+                    ok, result = merge_video_overlay(record["path"], overlay_path, out_file,
+                                                     local_dt, None, None, tz_off_str)
                 else:
                     ok, result = merge_images(record["path"], overlay_path, out_file)
 
                 if ok:
                     log_local(f"  ✓ Merged caption → {out_name}")
-                    _apply_file_metadata(out_file, is_video, local_dt, None, None,
-                                         tz_off_str, log_local)
+                    if is_video:
+                        log_local("    ✓ Video metadata (ffmpeg)")
+                        set_file_timestamps(out_file, local_dt)
+                    else:
+                        _apply_file_metadata(out_file, is_video, local_dt, None, None,
+                                             tz_off_str, log_local)
                 else:
                     log_local(f"  ⚠ Merge failed ({result}), copying original instead")
                     _copy_file_with_metadata(record["path"], out_file, is_video, local_dt,
@@ -3237,14 +2667,20 @@ class SnapchatDownloaderGUI:
                 out_file = str(output_path / out_name)
 
                 if is_video:
-                    ok, result = merge_video_overlay(file_path, overlay_path, out_file)
+                    # Tags are written by the merge itself; no second remux
+                    ok, result = merge_video_overlay(file_path, overlay_path, out_file,
+                                                     local_dt, latitude, longitude, tz_off_str)
                 else:
                     ok, result = merge_images(file_path, overlay_path, out_file)
 
                 if ok:
                     log_local(f"  ✓ Merged overlay → {out_name}")
-                    _apply_file_metadata(result, is_video, local_dt, latitude, longitude,
-                                        tz_off_str, log_local)
+                    if is_video:
+                        log_local("    ✓ Video metadata (ffmpeg)")
+                        set_file_timestamps(result, local_dt)
+                    else:
+                        _apply_file_metadata(result, is_video, local_dt, latitude, longitude,
+                                             tz_off_str, log_local)
                     primary_output = out_file
                 else:
                     log_local(f"  ⚠ Merge failed ({result}), copying original instead")
@@ -3340,7 +2776,7 @@ def _apply_file_metadata(path, is_video, date_obj, lat, lon, tz_offset, log_fn):
 
 def _copy_file_with_metadata(src, dst, is_video, date_obj, lat, lon, tz_offset, log_fn):
     """Copy src → dst and apply metadata."""
-    shutil.copy2(src, dst)
+    snap_utils.clone_file(src, dst)
     _apply_file_metadata(dst, is_video, date_obj, lat, lon, tz_offset, log_fn)
 
 
@@ -66,6 +66,7 @@ def set_image_exif_metadata(file_path, date_obj, latitude, longitude, timezone_o
         # Normalize orientation: we apply exif_transpose below when saving,
         # so the pixel data will be in correct display orientation.
         # Set Orientation=1 (normal) to prevent viewers from rotating again.
+        orientation = exif_dict["0th"].get(piexif.ImageIFD.Orientation, 1)
         exif_dict["0th"][piexif.ImageIFD.Orientation] = 1
         
         # Add timezone offset tags (EXIF 2.31 standard)
@@ -95,6 +96,18 @@ def set_image_exif_metadata(file_path, date_obj, latitude, longitude, timezone_o
         temp_path = src_path.with_suffix(src_path.suffix + ".exif.tmp")
 
         try:
+            if orientation in (1, None):
+                # Pixels are already upright: splice the new EXIF segment into
+                # the JPEG as-is. No decode/re-encode, so it is lossless and
+                # takes a fraction of the time.
+                try:
+                    # piexif writes to a path or BytesIO only, not an open file
+                    piexif.insert(exif_bytes, src_path.read_bytes(), str(temp_path))
+                    os.replace(str(temp_path), file_path)
+                    logging.info("Wrote EXIF metadata to %s", file_path)
+                    return True
+                except Exception as e:
+                    logging.debug("Lossless EXIF insert failed for %s, re-encoding: %s", file_path, e)
             img = Image.open(file_path)
             # Apply EXIF orientation to pixel data so the saved image is
             # in correct display orientation regardless of viewer support.
@@ -1,5 +1,11 @@
+import json
 import os
+import re
+import shutil
+import sys
 import logging
+import functools
+import threading
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -15,6 +21,74 @@ except Exception as e:
     _TIMEZONE_IMPORT_ERROR = e
     logging.debug("Timezone support libraries not available: %s", e, exc_info=True)
 
+if HAS_TIMEZONE_SUPPORT:
+    # Without a compiled point-in-polygon backend timezonefinder falls back to
+    # pure Python, which is roughly 100x slower on large libraries.
+    try:
+        _TZ_ACCELERATED = TimezoneFinder.using_numba() or getattr(TimezoneFinder, 'using_clang_pip', lambda: False)()
+    except Exception:
+        _TZ_ACCELERATED = True
+    if not _TZ_ACCELERATED:
+        logging.warning(
+            "timezonefinder is running without numba; install 'timezonefinder[numba]' "
+            "for a ~100x faster GPS timezone lookup on large exports"
+        )
+
+# Optional fast JSON parser for the (often tens of MB) export history files
+HAS_ORJSON = False
+try:
+    import orjson
+    HAS_ORJSON = True
+except Exception:
+    HAS_ORJSON = False
+
+# "Latitude, Longitude: 40.712800, -74.006000" -> the trailing coordinate pair
+_LOC_RE = re.compile(r'([-+]?\d+(?:\.\d+)?),\s*([-+]?\d+(?:\.\d+)?)\s*$')
+
+_EXTENSIONS = {"Image": ".jpg", "Video": ".mp4"}
+
+# Per-thread scratch state (downloads are validated from a worker pool)
+_thread_local = threading.local()
+
+# Shared TimezoneFinder, created on first GPS lookup (loading it is expensive)
+_tf_instance = None
+_tf_lock = threading.Lock()
+
+
+def _get_tf():
+    """Return the shared in-memory TimezoneFinder, creating it on first use."""
+    global _tf_instance
+    if _tf_instance is None:
+        with _tf_lock:
+            if _tf_instance is None:
+                _tf_instance = TimezoneFinder(in_memory=True)
+    return _tf_instance
+
+
+@functools.lru_cache(maxsize=4096)
+def _tz_name_for(lat_q, lng_q):
+    """Timezone name for a point on the ~1 km grid used by the lookup cache.
+
+    Memories from one trip share GPS within metres, so a whole vacation
+    resolves with a single polygon lookup.
+    """
+    return _get_tf().timezone_at(lat=lat_q, lng=lng_q)
+
+
+class _Lazy:
+    """Defer a formatting call until logging actually renders the record.
+
+    Passing ``_Lazy(dt.strftime, fmt)`` as a ``%s`` argument means the
+    strftime only runs when the message is emitted, not on every call.
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
 
 def parse_date(date_str):
     """Parse date string from JSON format to timezone-aware datetime object.
@@ -29,6 +103,14 @@ def parse_date(date_str):
     Returns:
         datetime: Timezone-aware datetime object in UTC
     """
+    # Fast path: "2023-01-15 10:30:00 UTC" -> "2023-01-15T10:30:00+00:00" for
+    # the C-implemented fromisoformat parser (much faster than strptime)
+    if len(date_str) == 23 and date_str[10] == " " and date_str.endswith(" UTC"):
+        try:
+            return datetime.fromisoformat(date_str[:10] + "T" + date_str[11:19] + "+00:00")
+        except ValueError:
+            pass
+
     # Parse the date string (ignoring the literal 'UTC' suffix)
     dt_naive = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S UTC")
     # Convert naive datetime to timezone-aware UTC
@@ -36,6 +118,17 @@ def parse_date(date_str):
     return dt_naive.replace(tzinfo=timezone.utc)
 
 
+@functools.lru_cache(maxsize=1)
+def _system_tz():
+    """Resolve the system timezone once; memories without GPS all share it."""
+    try:
+        import tzlocal
+        return pytz.timezone(tzlocal.get_localzone_name())
+    except Exception:
+        # Fallback: tzlocal missing or zone name unknown to pytz
+        return pytz.timezone('UTC')
+
+
 def convert_to_local_timezone(utc_datetime, latitude, longitude, force_system_tz=False):
     """
     Convert UTC datetime to local timezone using GPS coordinates or system timezone.
@@ -61,8 +154,7 @@ def convert_to_local_timezone(utc_datetime, latitude, longitude, force_system_tz
     # Try GPS-based timezone lookup if coordinates are available
     if not force_system_tz and latitude is not None and longitude is not None:
         try:
-            tf = TimezoneFinder()
-            tz_name = tf.timezone_at(lat=latitude, lng=longitude)
+            tz_name = _tz_name_for(round(latitude, 2), round(longitude, 2))
             if tz_name:
                 local_tz = pytz.timezone(tz_name)
                 local_dt = utc_datetime.astimezone(local_tz)
@@ -70,7 +162,7 @@ def convert_to_local_timezone(utc_datetime, latitude, longitude, force_system_tz
                 offset_str = (offset_str[:-2] + ":" + offset_str[-2:]) if len(offset_str) >= 5 else "+00:00"
                 logging.debug(
                     "Converted %s UTC to %s (%s) using GPS coordinates (%.4f, %.4f)",
-                    utc_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+                    _Lazy(utc_datetime.strftime, "%Y-%m-%d %H:%M:%S"),
                     tz_name,
                     offset_str,
                     latitude,
@@ -82,22 +174,14 @@ def convert_to_local_timezone(utc_datetime, latitude, longitude, force_system_tz
     
     # Fall back to system timezone
     try:
-        local_tz = pytz.timezone('UTC')
-        try:
-            import tzlocal
-            local_tz_str = tzlocal.get_localzone_name()
-            local_tz = pytz.timezone(local_tz_str)
-        except Exception:
-            # Fallback: try to detect from system
-            pass
-        
+        local_tz = _system_tz()
         local_dt = utc_datetime.astimezone(local_tz)
         offset_str = local_dt.strftime("%z")
         offset_str = (offset_str[:-2] + ":" + offset_str[-2:]) if len(offset_str) >= 5 else "+00:00"
         tz_name = str(local_tz)
         logging.debug(
             "Converted %s UTC to system timezone %s (%s)",
-            utc_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+            _Lazy(utc_datetime.strftime, "%Y-%m-%d %H:%M:%S"),
             tz_name,
             offset_str
         )
@@ -108,15 +192,21 @@ def convert_to_local_timezone(utc_datetime, latitude, longitude, force_system_tz
         return utc_datetime, "UTC", offset_str
 
 
+@functools.lru_cache(maxsize=1024)
 def parse_location(location_str):
-    """Parse location string to get latitude and longitude."""
+    """Parse location string to get latitude and longitude.
+
+    Results are cached since exports repeat the same location string for
+    every memory taken at one spot.
+    """
     if not location_str or location_str == "N/A":
         return None, None
 
     try:
-        coords = location_str.split(": ")[1]
-        lat, lon = coords.split(", ")
-        lat, lon = float(lat), float(lon)
+        m = _LOC_RE.search(location_str)
+        if not m:
+            return None, None
+        lat, lon = float(m.group(1)), float(m.group(2))
         if lat == 0.0 and lon == 0.0:
             return None, None
         return lat, lon
@@ -203,14 +293,64 @@ def _set_windows_creation_time(file_path, unix_timestamp):
         kernel32.CloseHandle(handle)
 
 
+# Linux ioctl that makes dst share src's extents copy-on-write (btrfs, XFS)
+_FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """Copy src to dst, sharing data blocks copy-on-write where possible.
+
+    On btrfs/XFS (FICLONE) and APFS (clonefile) the copy is instant and takes
+    no space until either side is modified; elsewhere this is shutil.copy2.
+    Hardlinks are deliberately not used: callers edit the copy in place, and
+    that would change the source too.
+
+    Returns:
+        dst
+    """
+    src, dst = os.fspath(src), os.fspath(dst)
+    try:
+        if sys.platform.startswith('linux'):
+            import fcntl
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        if sys.platform == 'darwin' and not os.path.exists(dst):
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+                return dst
+    except (OSError, AttributeError) as e:
+        logging.debug("Clone of %s failed, copying instead: %s", src, e)
+    return shutil.copy2(src, dst)
+
+
+def load_json(path):
+    """Load a JSON file, using orjson when it is installed.
+
+    Snapchat's memories_history.json and chat_history.json run to tens of
+    MB on large accounts; orjson parses them several times faster and reads
+    the bytes directly instead of decoding to str first.
+    """
+    if HAS_ORJSON:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
 def get_file_extension(media_type):
     """Determine file extension based on media type."""
-    if media_type == "Image":
-        return ".jpg"
-    elif media_type == "Video":
-        return ".mp4"
-    else:
-        return ".bin"
+    return _EXTENSIONS.get(media_type, ".bin")
+
+
+def _magic_buffer():
+    """Per-thread 32-byte buffer reused for magic-byte reads."""
+    buf = getattr(_thread_local, 'magic_buf', None)
+    if buf is None:
+        buf = _thread_local.magic_buf = bytearray(32)
+    return buf
 
 
 def validate_downloaded_file(file_path):
@@ -218,17 +358,21 @@ def validate_downloaded_file(file_path):
     try:
         logging.info(f"Validating downloaded file: {file_path}")
 
-        if not os.path.exists(file_path):
+        # One open + fstat + read: size and magic bytes come from the same fd
+        # instead of separate exists/getsize/open round-trips.
+        try:
+            f = open(file_path, 'rb', buffering=0)
+        except FileNotFoundError:
             logging.error(f"File does not exist: {file_path}")
             return False
 
-        file_size = os.path.getsize(file_path)
-        if file_size < 100:
-            logging.error(f"File is too small to be valid: {file_size} bytes")
-            return False
-
-        with open(file_path, 'rb') as f:
-            magic = f.read(32)
+        with f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size < 100:
+                logging.error(f"File is too small to be valid: {file_size} bytes")
+                return False
+            buf = _magic_buffer()
+            magic = memoryview(buf)[:f.readinto(buf)]
 
         is_valid_jpg = magic[:2] == b'\xff\xd8' or magic[:3] == b'\xff\xd8\xff'
         is_valid_png = magic[:8] == b'\x89PNG\r\n\x1a\n'
@@ -0,0 +1,38 @@
+"""
+Test EXIF writing for downloaded JPEG images.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+import pytest
+import exif_utils
+
+Image = pytest.importorskip("PIL.Image")
+piexif = pytest.importorskip("piexif")
+
+
+def _scan_data(data):
+    """Return the JPEG bytes from the first start-of-scan marker on."""
+    return data[data.index(b'\xff\xda'):]
+
+
+def test_upright_jpeg_keeps_scan_data(tmp_path):
+    """Test that tagging an upright JPEG splices EXIF in without re-encoding."""
+    path = tmp_path / "photo.jpg"
+    Image.new('RGB', (40, 20), (0, 0, 255)).save(path, quality=80)
+    before = path.read_bytes()
+
+    assert exif_utils.set_image_exif_metadata(str(path), datetime(2020, 1, 2, 3, 4, 5), 40.5, -73.25)
+
+    after = path.read_bytes()
+    assert _scan_data(after) == _scan_data(before)
+    exif = piexif.load(str(path))
+    assert exif["Exif"][piexif.ExifIFD.DateTimeOriginal] == b"2020:01:02 03:04:05"
+    assert exif["GPS"][piexif.GPSIFD.GPSLatitudeRef] == b"N"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,26 @@
+"""
+Test location string parsing from the Snapchat JSON export.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import snap_utils
+
+
+def test_parse_location_valid():
+    """Test that a standard export location string yields (lat, lon)."""
+    lat, lon = snap_utils.parse_location("Latitude, Longitude: 40.7128, -74.006")
+    assert lat == pytest.approx(40.7128)
+    assert lon == pytest.approx(-74.006)
+
+
+def test_parse_location_missing():
+    """Test that empty, N/A, zero and malformed locations yield (None, None)."""
+    for value in ("", None, "N/A", "Latitude, Longitude: 0.0, 0.0", "garbage"):
+        assert snap_utils.parse_location(value) == (None, None), f"Unexpected result for {value!r}"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,96 @@
+"""
+Test the libavfilter rotation graph used by the PyAV conversion paths.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import video_utils
+
+av = pytest.importorskip("av")
+np = pytest.importorskip("numpy")
+
+
+def _make_clip(path, frames=5, display_rotation=None, pix_fmt='yuv420p'):
+    """Write a 64x32 H.264 clip with a white band down the left edge."""
+    container = av.open(str(path), 'w')
+    stream = container.add_stream('h264', rate=10)
+    stream.width = 64
+    stream.height = 32
+    stream.pix_fmt = pix_fmt
+    if display_rotation is not None:
+        stream.set_display_rotation(display_rotation)
+    for _ in range(frames):
+        arr = np.zeros((32, 64, 3), np.uint8)
+        arr[:, :10] = 255
+        for packet in stream.encode(av.VideoFrame.from_ndarray(arr, format='rgb24')):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+
+
+@pytest.mark.parametrize("rotation, shape, band", [
+    (90, (64, 32), 'top'),
+    (180, (32, 64), 'right'),
+    (270, (64, 32), 'bottom'),
+])
+def test_rotation_graph_rotates_clockwise(tmp_path, rotation, shape, band):
+    """Test that frames come out rotated clockwise with no frames dropped."""
+    clip = tmp_path / "clip.mp4"
+    _make_clip(clip)
+
+    container = av.open(str(clip))
+    stream = container.streams.video[0]
+    graph = video_utils._build_rotation_graph(stream, rotation)
+    out = []
+    for frame in container.decode(stream):
+        out.extend(video_utils._filter_frame(graph, frame))
+    out.extend(video_utils._filter_frame(graph, None))
+    container.close()
+
+    assert len(out) == 5
+    gray = out[0].to_ndarray(format='gray')
+    assert gray.shape == shape
+    edges = {'top': gray[:5], 'bottom': gray[-5:], 'left': gray[:, :5], 'right': gray[:, -5:]}
+    assert edges[band].mean() > 200, f"Band not on the {band} edge after {rotation}° rotation"
+
+
+def test_format_only_graph_outputs_yuv420p(tmp_path):
+    """Test that rotation 0 only converts the pixel format, keeping size and frames."""
+    clip = tmp_path / "clip.mp4"
+    _make_clip(clip, pix_fmt='yuv444p')
+
+    container = av.open(str(clip))
+    stream = container.streams.video[0]
+    graph = video_utils._build_rotation_graph(stream, 0)
+    out = []
+    for frame in container.decode(stream):
+        out.extend(video_utils._filter_frame(graph, frame))
+    out.extend(video_utils._filter_frame(graph, None))
+    container.close()
+
+    assert len(out) == 5
+    assert out[0].format.name == 'yuv420p'
+    assert (out[0].width, out[0].height) == (64, 32)
+
+
+def test_pyav_probe_reads_display_matrix(tmp_path):
+    """Test that the in-process probe reports the same clockwise rotation as ffprobe."""
+    if not hasattr(av.video.stream.VideoStream, 'set_display_rotation'):
+        pytest.skip("PyAV too old to write a display matrix")
+    clip = tmp_path / "clip.mp4"
+    # Display matrix +90 (counter-clockwise) is what ffprobe reports for a
+    # clip that needs a 270° clockwise turn
+    _make_clip(clip, display_rotation=90)
+
+    info = video_utils._probe_with_pyav(clip)
+    assert info['codec'] == 'h264'
+    assert (info['width'], info['height']) == (64, 32)
+    assert info['rotation'] == 270
+    assert not info['has_audio']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
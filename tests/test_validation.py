@@ -77,5 +77,113 @@ def test_validate_video_file_invalid_format():
             temp_path.unlink()
 
 
+def test_validate_video_file_quick_mode():
+    """Test that quick mode checks box structure and rejects truncated files."""
+    import struct
+
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+    complete = box(b'ftyp', b'isom' + b'\0' * 8) + box(b'mdat', b'\0' * 2000) + box(b'moov', b'\0' * 64)
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+        temp_path = Path(f.name)
+        f.write(complete)
+
+    try:
+        is_valid, info = video_utils.validate_video_file(temp_path, quick=True)
+        assert is_valid, f"Quick validation failed for well-formed MP4: {info}"
+        assert info['has_video']
+
+        # Cut off the moov box, as an interrupted download would
+        temp_path.write_bytes(complete[:-40])
+        is_valid, info = video_utils.validate_video_file(temp_path, quick=True)
+        assert not is_valid, "Truncated MP4 should fail quick validation"
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+def test_quick_mode_accepts_quicktime_leading_boxes():
+    """Test that a MOV opening with wide padding passes the box check."""
+    import struct
+
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+    with tempfile.NamedTemporaryFile(suffix=".mov", delete=False) as f:
+        temp_path = Path(f.name)
+        f.write(box(b'wide', b'') + box(b'mdat', b'\0' * 2000) + box(b'moov', b'\0' * 64))
+
+    try:
+        assert video_utils._quick_mp4_check(temp_path)
+        temp_path.write_bytes(box(b'junk', b'') + box(b'moov', b'\0' * 64))
+        assert not video_utils._quick_mp4_check(temp_path)
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
+@pytest.mark.skipif(not video_utils.HAS_PYAV, reason="PyAV not installed")
+def test_validate_video_file_probes_without_ffprobe(monkeypatch, tmp_path):
+    """PyAV alone is enough to probe; junk isn't passed on size alone"""
+    monkeypatch.setattr(video_utils, 'check_ffprobe', lambda: False)
+    junk = tmp_path / "junk.mp4"
+    junk.write_bytes(b'\x00\x00\x00\x20ftypisom' + b'\x00' * 2000)
+
+    is_valid, info = video_utils.validate_video_file(junk)
+    assert not is_valid
+    assert info['error'] == 'No video stream found'
+
+
+def test_probe_cache_drops_least_recently_used(monkeypatch, tmp_path):
+    """The probe cache is bounded, evicting the least recently used file"""
+    monkeypatch.setattr(video_utils, '_probe_cache', video_utils.OrderedDict())
+    monkeypatch.setattr(video_utils, '_PROBE_CACHE_SIZE', 2)
+    monkeypatch.setattr(video_utils, 'HAS_PYAV', True)
+    monkeypatch.setattr(video_utils, '_probe_with_pyav', lambda p: {'codec': 'h264', 'path': str(p)})
+    paths = []
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        path = tmp_path / name
+        path.write_bytes(b'\x00' * 10)
+        paths.append(path)
+
+    video_utils.probe_video(paths[0])
+    video_utils.probe_video(paths[1])
+    video_utils.probe_video(paths[0])  # a is now the most recent
+    video_utils.probe_video(paths[2])
+    cached = [key[0] for key in video_utils._probe_cache]
+    assert cached == [str(paths[0]), str(paths[2])]
+
+
+def test_read_mp4_duration_from_mvhd():
+    """Test that the mvhd duration is read for both box versions."""
+    import struct
+
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+    mvhd_v0 = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, 2500) + b'\0' * 80)
+    mvhd_v1 = box(b'mvhd', b'\x01' + b'\0' * 19 + struct.pack('>IQ', 600, 3600) + b'\0' * 80)
+    header = box(b'ftyp', b'isom' + b'\0' * 8) + box(b'mdat', b'\0' * 2000)
+
+    with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as f:
+        temp_path = Path(f.name)
+
+    try:
+        temp_path.write_bytes(header + box(b'moov', box(b'free', b'') + mvhd_v0))
+        assert video_utils.read_mp4_duration(temp_path) == 2.5
+
+        temp_path.write_bytes(header + box(b'moov', mvhd_v1))
+        assert video_utils.read_mp4_duration(temp_path) == 6.0
+
+        # No moov at all, as with a truncated download
+        temp_path.write_bytes(header)
+        assert video_utils.read_mp4_duration(temp_path) is None
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
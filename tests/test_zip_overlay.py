@@ -0,0 +1,136 @@
+"""
+Test merging of -main/-overlay pairs from Snapchat ZIP exports.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zipfile
+from datetime import datetime
+import pytest
+import zip_utils
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _make_zip(path, pairs):
+    """Write a ZIP holding `pairs` blue JPEG mains with half-transparent red overlays."""
+    with zipfile.ZipFile(path, 'w') as z:
+        for i in range(pairs):
+            main = path.parent / f"main{i}.jpg"
+            overlay = path.parent / f"overlay{i}.png"
+            Image.new('RGB', (40, 20), (0, 0, 255)).save(main)
+            Image.new('RGBA', (40, 20), (255, 0, 0, 128)).save(overlay)
+            z.write(main, f"pair{i}-main.jpg")
+            z.write(overlay, f"pair{i}-overlay.png")
+        z.writestr("readme.txt", "not media")
+
+
+def test_image_pairs_merge_to_unique_names(tmp_path):
+    """Test that concurrently merged pairs sharing a date all get distinct names."""
+    zip_path = tmp_path / "memories.zip"
+    _make_zip(zip_path, 4)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    merged = zip_utils.process_zip_overlay(str(zip_path), str(out_dir), datetime(2020, 1, 1))
+
+    assert sorted(os.path.basename(p) for p in merged) == [
+        "20200101_000000.jpg", "20200101_000000_1.jpg",
+        "20200101_000000_2.jpg", "20200101_000000_3.jpg",
+    ]
+    r, g, b = Image.open(merged[0]).getpixel((5, 5))
+    assert r > 100 and b > 100, "Overlay was not blended over the main image"
+
+
+def test_blank_overlay_keeps_original_image(tmp_path):
+    """Test that a fully transparent overlay leaves the main image bytes untouched."""
+    main = tmp_path / "main.jpg"
+    overlay = tmp_path / "overlay.png"
+    Image.new('RGB', (40, 20), (0, 0, 255)).save(main)
+    Image.new('RGBA', (40, 20), (0, 0, 0, 0)).save(overlay)
+    out = tmp_path / "merged.jpg"
+
+    ok, result = zip_utils.merge_images(str(main), str(overlay), str(out))
+
+    assert ok
+    assert out.read_bytes() == main.read_bytes()
+
+
+def test_rename_never_overwrites_unlisted_file(tmp_path):
+    """Test that a name taken after the directory was listed is skipped, not replaced."""
+    taken = tmp_path / "20200101_000000.jpg"
+    taken.write_bytes(b"other download")
+    merged = tmp_path / "x-merged.jpg"
+    merged.write_bytes(b"merged")
+
+    new_path = zip_utils._rename_to_date_path(merged, tmp_path, "20200101_000000", ".jpg", set())
+
+    assert new_path.name == "20200101_000000_1.jpg"
+    assert new_path.read_bytes() == b"merged"
+    assert taken.read_bytes() == b"other download"
+    assert not merged.exists()
+
+
+def test_full_ram_scratch_falls_back_to_disk_temp(tmp_path, monkeypatch):
+    """Test that ENOSPC in the RAM scratch dir retries extraction in the default temp dir."""
+    import errno
+    import shutil
+    ram = tmp_path / "ram"
+    ram.mkdir()
+    extracted_to = []
+    real_extract = zip_utils._extract_members
+
+    def extract(zip_ref, names, temp_dir, pool):
+        extracted_to.append(temp_dir.parent)
+        if temp_dir.parent == ram:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        real_extract(zip_ref, names, temp_dir, pool)
+
+    def merge(main, overlay, out, **kwargs):
+        shutil.copyfile(main, out)
+        return True, out
+
+    monkeypatch.setattr(zip_utils, '_scratch_parent', lambda needed: str(ram))
+    monkeypatch.setattr(zip_utils, '_extract_members', extract)
+    monkeypatch.setattr(zip_utils, 'merge_video_overlay', merge)
+    zip_path = tmp_path / "memories.zip"
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr("clip-main.mp4", b"video")
+        z.writestr("clip-overlay.png", b"overlay")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    merged = zip_utils.process_zip_overlay(str(zip_path), str(out_dir), datetime(2020, 1, 1))
+
+    assert [os.path.basename(p) for p in merged] == ["20200101_000000.mp4"]
+    assert extracted_to[0] == ram and extracted_to[1] != ram
+    assert not list(ram.iterdir())
+
+
+def test_incomplete_pair_is_skipped(tmp_path):
+    """Test that a -main without an -overlay produces no output."""
+    zip_path = tmp_path / "memories.zip"
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr("lonely-main.jpg", b"")
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+
+    assert zip_utils.process_zip_overlay(str(zip_path), str(out_dir)) == []
+    assert not list(out_dir.iterdir())
+
+
+def test_extract_media_prefers_video_over_overlay(tmp_path):
+    """Test that a video memory's ZIP yields the video, not the PNG listed first."""
+    zip_path = tmp_path / "memory.zip"
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr("clip-overlay.png", b"overlay")
+        z.writestr("clip-main.mp4", b"video")
+    out = tmp_path / "memory.mp4"
+
+    assert zip_utils.extract_media_from_zip(str(zip_path), str(out))
+    assert out.read_bytes() == b"video"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -2,43 +2,71 @@ import logging
 import os
 import shutil
 import subprocess
+import json
 import time
 import sys
+import contextlib
+import errno
+import functools
+import importlib.util
+import queue
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
+from fractions import Fraction
+
+import snap_utils
 
 # Windows-specific subprocess flag to prevent command windows from popping up
 CREATE_NO_WINDOW = 0x08000000 if sys.platform == 'win32' else 0
 
-# Optional libs
-HAS_MUTAGEN = False
-try:
-    from mutagen.mp4 import MP4
-    HAS_MUTAGEN = True
-except Exception:
-    HAS_MUTAGEN = False
-
-HAS_PYAV = False
-try:
-    import av
-    HAS_PYAV = True
-except Exception:
-    HAS_PYAV = False
-
-HAS_VLC = False
-try:
-    import vlc
-    HAS_VLC = True
-except Exception:
-    HAS_VLC = False
-
-# PIL for frame rotation during video conversion
-HAS_PIL = False
+# Environment for ffmpeg/ffprobe spawns. On Windows CreateProcess copies
+# the whole environment block (often tens of KB) into every child, so pass a
+# trimmed one built once here. Elsewhere None inherits environ as-is, which
+# is cheaper than handing subprocess a dict to rebuild per spawn. VLC is not
+# given it: it reads plugin, cache and locale settings from many variables.
+_SPAWN_ENV_KEYS = ('PATH', 'PATHEXT', 'SYSTEMROOT', 'SYSTEMDRIVE', 'WINDIR', 'COMSPEC',
+                   'TEMP', 'TMP', 'USERPROFILE', 'APPDATA', 'LOCALAPPDATA')
+SPAWN_ENV = ({k: v for k, v in os.environ.items() if k.upper() in _SPAWN_ENV_KEYS}
+             if sys.platform == 'win32' else None)
+
+# Optional libs. av, vlc and mutagen are only located here and imported on
+# first use: av loads large extension modules and vlc dlopens libVLC, which
+# runs that never decode or convert a video shouldn't pay for at startup.
+HAS_MUTAGEN = importlib.util.find_spec('mutagen') is not None
+HAS_PYAV = importlib.util.find_spec('av') is not None
+HAS_VLC = importlib.util.find_spec('vlc') is not None
+av = None
+vlc = None
+
+
+def _load_av():
+    """Import PyAV on first use and bind it to the module-level ``av``."""
+    global av
+    if av is None:
+        import av as av_module
+        av = av_module
+    return av
+
+
+def _load_vlc():
+    """Import python-vlc on first use and bind it to the module-level ``vlc``."""
+    global vlc
+    if vlc is None:
+        import vlc as vlc_module
+        vlc = vlc_module
+    return vlc
+
+# orjson parses ffprobe JSON several times faster than the stdlib
+HAS_ORJSON = False
 try:
-    from PIL import Image as PILImage
-    HAS_PIL = True
+    import orjson
+    HAS_ORJSON = True
 except Exception:
-    HAS_PIL = False
+    HAS_ORJSON = False
 
 
 def sanitize_path(path):
@@ -63,6 +91,109 @@ def sanitize_path(path):
     return Path(path_str).resolve()
 
 
+def _safe_unlink(path):
+    """Remove a file if present.
+
+    EAFP instead of exists()+remove(): one syscall, and no race when another
+    cleanup path already removed it.
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.debug(f"Could not remove {path}: {e}")
+
+
+def _replace_original(new_path, file_path):
+    """Swap a verified output file into place over the original.
+
+    os.replace is a single atomic rename on the same volume. Only when that
+    fails (e.g. cross-device temp) fall back to move-aside/move-in/drop-backup.
+    Raises OSError if the file could not be put in place; the original is
+    restored when possible.
+    """
+    try:
+        os.replace(new_path, file_path)
+        return
+    except OSError as e:
+        logging.debug(f"os.replace({new_path}, {file_path}) failed, using backup move: {e}")
+    backup = f"{file_path}.backup"
+    shutil.move(file_path, backup)
+    try:
+        shutil.move(new_path, file_path)
+    except Exception:
+        if not os.path.exists(file_path):
+            shutil.move(backup, file_path)
+        raise
+    _safe_unlink(backup)
+
+
+def _fadvise(path, advice):
+    """Apply a posix_fadvise hint to a whole file through a throwaway fd.
+
+    No-op where posix_fadvise is unavailable (Windows, macOS).
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError as e:
+        logging.debug(f"posix_fadvise failed for {path}: {e}")
+    finally:
+        os.close(fd)
+
+
+def _prefetch_file(path):
+    """Start asynchronous readahead of a file the demuxer is about to read.
+
+    PyAV opens its own descriptor, so POSIX_FADV_SEQUENTIAL (which only
+    widens readahead for the descriptor it is issued on) can't reach it.
+    POSIX_FADV_WILLNEED populates the shared page cache instead, so the
+    decoder's reads hit memory rather than waiting on the disk.
+    """
+    if hasattr(os, 'POSIX_FADV_WILLNEED'):
+        _fadvise(path, os.POSIX_FADV_WILLNEED)
+
+
+def _drop_page_cache(path):
+    """Tell the kernel a fully processed file's cached pages won't be reused.
+
+    Batch conversions stream many large videos through once each; without
+    this they push everything else out of the page cache. POSIX_FADV_DONTNEED
+    acts on the file's pages regardless of which descriptor issues it.
+    """
+    if hasattr(os, 'POSIX_FADV_DONTNEED'):
+        _fadvise(path, os.POSIX_FADV_DONTNEED)
+
+
+def _rotation_from_probe_stream(stream, file_path=None):
+    """Clockwise rotation from one ffprobe JSON video stream entry."""
+    rotation = 0
+    tags = stream.get('tags', {})
+    if 'rotate' in tags:
+        # The 'rotate' tag directly gives the CW rotation needed
+        rotation = int(tags['rotate'])
+
+    # Only fall back to Display Matrix if 'rotate' tag was not found.
+    # IMPORTANT: The Display Matrix 'rotation' value has the OPPOSITE
+    # sign convention from the 'rotate' tag.  rotate=90 (CW) corresponds
+    # to Display Matrix rotation=-90.  We negate the display matrix value
+    # to obtain the clockwise rotation needed.
+    # (Newer ffmpeg versions drop the 'rotate' tag entirely, so this
+    # fallback is essential for those builds.)
+    if rotation == 0:
+        for sd in stream.get('side_data_list', []):
+            if sd.get('side_data_type') == 'Display Matrix' and 'rotation' in sd:
+                rotation = -int(float(sd['rotation']))
+                logging.debug(f"Using Display Matrix rotation (negated): {rotation}° for {file_path}")
+    return rotation
+
+
 def _get_video_rotation(file_path):
     """Detect rotation metadata from a video file.
     
@@ -76,53 +207,11 @@ def _get_video_rotation(file_path):
     """
     rotation = 0
     
-    # Try ffprobe first (most reliable)
-    if check_ffmpeg():
-        try:
-            import json as _json
-            cmd = [
-                'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-                '-show_entries', 'stream_tags=rotate:stream_side_data_list',
-                '-of', 'json', str(file_path)
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10, creationflags=CREATE_NO_WINDOW)
-            if result.returncode == 0 and result.stdout.strip():
-                data = _json.loads(result.stdout)
-                streams = data.get('streams', [])
-                if streams:
-                    tags = streams[0].get('tags', {})
-                    if 'rotate' in tags:
-                        # The 'rotate' tag directly gives the CW rotation needed
-                        rotation = int(tags['rotate'])
-                    
-                    # Only fall back to Display Matrix if 'rotate' tag was not found.
-                    # IMPORTANT: The Display Matrix 'rotation' value has the OPPOSITE
-                    # sign convention from the 'rotate' tag.  rotate=90 (CW) corresponds
-                    # to Display Matrix rotation=-90.  We negate the display matrix value
-                    # to obtain the clockwise rotation needed.
-                    # (Newer ffmpeg versions drop the 'rotate' tag entirely, so this
-                    # fallback is essential for those builds.)
-                    if rotation == 0:
-                        side_data = streams[0].get('side_data_list', [])
-                        for sd in side_data:
-                            if sd.get('side_data_type') == 'Display Matrix' and 'rotation' in sd:
-                                rotation = -int(float(sd['rotation']))
-                                logging.debug(f"Using Display Matrix rotation (negated): {rotation}° for {file_path}")
-        except Exception as e:
-            logging.debug(f"Could not detect rotation via ffprobe: {e}")
-    
-    # Try PyAV metadata fallback
-    if rotation == 0 and HAS_PYAV:
-        try:
-            container = av.open(str(file_path))
-            vstream = container.streams.video[0]
-            # Check stream metadata for rotate tag
-            if hasattr(vstream, 'metadata') and vstream.metadata:
-                rotate_val = vstream.metadata.get('rotate', '0')
-                rotation = int(rotate_val)
-            container.close()
-        except Exception as e:
-            logging.debug(f"Could not detect rotation via PyAV: {e}")
+    # Shares the cached probe_video result (PyAV or ffprobe); both backends
+    # already read the legacy rotate tag as well as the display matrix
+    probe = probe_video(file_path)
+    if probe:
+        rotation = probe['rotation']
     
     # Normalize to 0-359 range, handle negative values
     rotation = rotation % 360
@@ -133,15 +222,446 @@ def _get_video_rotation(file_path):
     return rotation
 
 
+def _build_rotation_graph(video_stream, rotation):
+    """Build a libavfilter graph that rotates decoded frames clockwise.
+
+    Frames stay in YUV the whole way through (transpose/flip run inside
+    libavfilter), so there is no per-frame RGB/PIL round-trip. The graph
+    always ends in yuv420p, the encoder's input format.
+
+    Args:
+        video_stream: Input PyAV video stream (used as the buffer template)
+        rotation: Clockwise rotation in degrees (90, 180 or 270), or 0 for
+            the pixel format conversion alone
+
+    Returns:
+        Configured av.filter.Graph
+    """
+    if rotation == 90:
+        chain = [('transpose', 'clock')]
+    elif rotation == 270:
+        chain = [('transpose', 'cclock')]
+    elif rotation == 180:
+        chain = [('hflip', None), ('vflip', None)]
+    else:
+        chain = []
+    chain.append(('format', 'yuv420p'))
+
+    graph = _load_av().filter.Graph()
+    node = graph.add_buffer(template=video_stream)
+    for name, args in chain:
+        next_node = graph.add(name, args)
+        node.link_to(next_node)
+        node = next_node
+    node.link_to(graph.add('buffersink'))
+    graph.configure()
+    return graph
+
+
+def _filter_frame(graph, frame):
+    """Push one frame through a filter graph and return the frames it yields."""
+    graph.push(frame)
+    frames = []
+    while True:
+        try:
+            frames.append(graph.pull())
+        except (av.error.BlockingIOError, av.error.EOFError):
+            return frames
+
+
+_DECODE_DONE = object()
+
+
+@contextlib.contextmanager
+def _decode_ahead(container, streams, maxsize=16, video_graph=None):
+    """Demux+decode (and filter) on a worker thread into a bounded queue.
+
+    Yields an iterator of (stream_type, frame). At most ``maxsize`` decoded
+    frames are held ahead of the encoder, so memory stays flat however long
+    the clip is. Decoder errors are re-raised in the consuming thread; on
+    exit the worker is stopped and joined before the container can be closed.
+
+    With ``video_graph`` (see _build_rotation_graph), video frames are pushed
+    through it on the worker too, and the graph is flushed at end of input,
+    so the consuming thread only encodes and muxes.
+    """
+    frames = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for packet in container.demux(streams):
+                kind = packet.stream.type
+                for frame in packet.decode():
+                    if kind == 'video' and video_graph is not None:
+                        out_frames = _filter_frame(video_graph, frame)
+                    else:
+                        out_frames = (frame,)
+                    for out_frame in out_frames:
+                        if not put((kind, out_frame)):
+                            return
+            if video_graph is not None:
+                for out_frame in _filter_frame(video_graph, None):
+                    if not put(('video', out_frame)):
+                        return
+        except Exception as e:
+            put(e)
+        else:
+            put(_DECODE_DONE)
+
+    def consume():
+        while True:
+            item = frames.get()
+            if item is _DECODE_DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    worker = threading.Thread(target=produce, name="pyav-decode", daemon=True)
+    worker.start()
+    try:
+        yield consume()
+    finally:
+        stop.set()
+        worker.join()
+
+
+# probe_video results keyed by (path, mtime_ns, size) so a rewritten file is re-probed.
+# Least recently used entries are dropped past _PROBE_CACHE_SIZE, so a long
+# run over a large export doesn't keep every probe alive.
+_PROBE_CACHE_SIZE = 256
+_probe_cache = OrderedDict()
+_probe_cache_lock = threading.Lock()
+
+
+def _probe_with_pyav(file_path):
+    """probe_video backend that reads the file in-process through PyAV.
+
+    No ffprobe process is spawned, and libavformat stays loaded between
+    files. The display matrix isn't exposed on PyAV streams, so rotation is
+    read from the first decoded frame. Returns None (so ffprobe is used) when
+    this PyAV is too old to report frame rotation.
+    """
+    try:
+        container = _load_av().open(str(file_path))
+    except Exception as e:
+        logging.debug(f"PyAV probe failed for {file_path}: {e}")
+        return None
+    try:
+        info = {'codec': None, 'width': None, 'height': None, 'rotation': 0,
+                'duration': None, 'bitrate': None, 'has_video': False,
+                'has_audio': bool(container.streams.audio)}
+        if container.duration is not None:
+            info['duration'] = container.duration / av.time_base
+        if container.bit_rate:
+            info['bitrate'] = container.bit_rate
+        if container.streams.video:
+            stream = container.streams.video[0]
+            info['has_video'] = True
+            info['codec'] = stream.codec_context.name
+            info['width'] = stream.codec_context.width
+            info['height'] = stream.codec_context.height
+            rotation = int(stream.metadata.get('rotate', 0))
+            if rotation == 0:
+                # Frame rotation is the display matrix angle (counter-
+                # clockwise), the same value ffprobe reports; negate it
+                # for the clockwise convention, as in _rotation_from_probe_stream.
+                for frame in container.decode(stream):
+                    if not hasattr(frame, 'rotation'):
+                        # PyAV before 13 doesn't expose it; reporting 0 would
+                        # silently leave rotated clips sideways
+                        if check_ffprobe():
+                            logging.debug("PyAV can't read the display matrix, probing with ffprobe")
+                            return None
+                        break
+                    rotation = -int(round(frame.rotation or 0))
+                    break
+            info['rotation'] = rotation % 360
+        return info
+    except Exception as e:
+        logging.debug(f"PyAV probe failed for {file_path}: {e}")
+        return None
+    finally:
+        container.close()
+
+
+def _probe_with_ffprobe(file_path):
+    """probe_video backend that runs one ffprobe process."""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries',
+        'format=duration,bit_rate:stream=codec_type,codec_name,width,height:stream_tags=rotate:stream_side_data_list',
+        # Compact JSON: one line per section. Still JSON rather than csv,
+        # because the display matrix rotation is nested side data.
+        '-of', 'json=c=1', str(file_path)
+    ]
+    try:
+        # Only stdout is used: keep it as bytes and discard stderr undecoded
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=10, env=SPAWN_ENV, creationflags=CREATE_NO_WINDOW)
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        data = orjson.loads(result.stdout) if HAS_ORJSON else json.loads(result.stdout)
+    except Exception as e:
+        logging.debug(f"ffprobe failed for {file_path}: {e}")
+        return None
+
+    info = {'codec': None, 'width': None, 'height': None, 'rotation': 0,
+            'duration': None, 'bitrate': None, 'has_video': False, 'has_audio': False}
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and not info['has_video']:
+            info['has_video'] = True
+            info['codec'] = stream.get('codec_name')
+            info['width'] = stream.get('width')
+            info['height'] = stream.get('height')
+            info['rotation'] = _rotation_from_probe_stream(stream, file_path) % 360
+        elif stream.get('codec_type') == 'audio':
+            info['has_audio'] = True
+    fmt = data.get('format', {})
+    try:
+        info['duration'] = float(fmt.get('duration'))
+    except (TypeError, ValueError):
+        pass
+    try:
+        info['bitrate'] = int(fmt.get('bit_rate'))
+    except (TypeError, ValueError):
+        pass
+    return info
+
+
+def probe_video(file_path):
+    """Probe codec, dimensions, rotation, duration and audio in one pass.
+
+    Uses PyAV in-process when it is installed, so a batch probes every file
+    without spawning a single process; otherwise (or if PyAV can't read the
+    file) one ffprobe call. Results are cached per file version, so callers
+    that need several of these fields (rotation, codec short-circuit,
+    validation) share one probe per file.
+
+    Returns:
+        dict with keys codec, width, height, rotation, duration, bitrate,
+        has_video, has_audio, or None if no backend is available or both fail.
+    """
+    if not can_probe():
+        return None
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    key = (str(file_path), st.st_mtime_ns, st.st_size)
+    with _probe_cache_lock:
+        cached = _probe_cache.get(key)
+        if cached is not None:
+            _probe_cache.move_to_end(key)
+            return dict(cached)
+
+    info = _probe_with_pyav(file_path) if HAS_PYAV else None
+    if info is None and check_ffprobe():
+        info = _probe_with_ffprobe(file_path)
+    if info is None:
+        return None
+
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+        while len(_probe_cache) > _PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return dict(info)
+
+
+def probe_many(paths, workers=None):
+    """Run probe_video over many files concurrently.
+
+    Probes are overlapped on a thread pool: the work happens in ffprobe
+    child processes or in libav calls that release the GIL, so threads are
+    enough. Results land in the probe_video cache, so later per-file calls
+    are free.
+
+    Args:
+        paths: Iterable of video paths
+        workers: Concurrent probes (default: CPU count, max 8)
+
+    Returns:
+        Dict mapping each path (as given) to its probe_video result (or None)
+    """
+    paths = list(paths)
+    if len(paths) <= 1 or not can_probe():
+        return {p: probe_video(p) for p in paths}
+    if workers is None:
+        workers = min(8, os.cpu_count() or 2)
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return dict(zip(paths, pool.map(probe_video, paths)))
+
+
+@functools.lru_cache(maxsize=1)
 def check_ffmpeg():
-    import shutil
+    """Whether ffmpeg is on PATH. Cached: PATH doesn't change during a run."""
     return shutil.which('ffmpeg') is not None
 
 
+@functools.lru_cache(maxsize=1)
+def check_ffprobe():
+    """Whether ffprobe is on PATH. Some ffmpeg builds ship without it."""
+    return shutil.which('ffprobe') is not None
+
+
+def can_probe():
+    """Whether probe_video has a backend: PyAV in-process or ffprobe."""
+    return HAS_PYAV or check_ffprobe()
+
+
+# ffmpeg encoder arguments, in order of preference. Hardware encoders are
+# only used after a tiny trial encode succeeds: ffmpeg builds list nvenc/qsv
+# even on machines without the matching GPU.
+_FFMPEG_H264_ENCODERS = {
+    'h264_nvenc': ['-preset', 'p4', '-rc', 'vbr', '-cq', '20'],
+    'h264_qsv': ['-preset', 'veryfast', '-global_quality', '20'],
+    'h264_videotoolbox': ['-b:v', '8M'],
+    'h264_amf': ['-quality', 'speed', '-rc', 'cqp', '-qp_i', '20', '-qp_p', '20'],
+    'libx264': ['-crf', '18', '-preset', 'veryfast'],
+}
+
+# Hardware decode for ffmpeg transcodes. 'auto' picks the platform's API
+# (d3d11va/dxva2, videotoolbox, vaapi, cuda) and silently falls back to
+# software decode when none initialises. Frames are downloaded to system
+# memory, so ffmpeg's auto-rotate filter and software encoders still work.
+_FFMPEG_HWACCEL_ARGS = ['-hwaccel', 'auto']
+
+# PyAV codec options for the same encoders ('h264' is PyAV's libx264 default).
+# Quality settings mirror the ffmpeg flags above; without them the hardware
+# encoders fall back to their low default bitrates (e.g. NVENC's 2 Mb/s).
+_PYAV_H264_OPTIONS = {
+    'h264_nvenc': {'preset': 'p4', 'rc': 'vbr', 'cq': '20'},
+    'h264_qsv': {'preset': 'veryfast', 'global_quality': '20'},
+    'h264_videotoolbox': {'b': '8M'},
+    'h264_amf': {'quality': 'speed', 'rc': 'cqp', 'qp_i': '20', 'qp_p': '20'},
+    'h264': {'preset': 'veryfast', 'g': '60'},
+}
+
+
+# Box types an MP4/QuickTime file may open with. QuickTime writers can put
+# wide or free padding before ftyp, and some files open with mdat or moov.
+_MP4_LEADING_BOXES = (b'ftyp', b'wide', b'free', b'mdat', b'moov')
+
+# Consumer NVIDIA cards cap concurrent NVENC sessions (~3); the GUI converts
+# from several download threads at once, so hold a session slot per encode.
+_NVENC_SESSIONS = threading.BoundedSemaphore(2)
+
+
+def _hw_encoder_candidates():
+    if sys.platform == 'darwin':
+        return ['h264_videotoolbox']
+    candidates = ['h264_nvenc', 'h264_qsv']
+    if sys.platform == 'win32':
+        candidates.append('h264_amf')
+    return candidates
+
+
+@functools.lru_cache(maxsize=1)
+def get_ffmpeg_h264_encoder():
+    """Pick the fastest working H.264 encoder for ffmpeg command lines.
+
+    Probed once per process. Falls back to libx264 when no hardware encoder
+    is usable.
+
+    Returns:
+        Tuple of (encoder_name: str, encoder_args: list)
+    """
+    if check_ffmpeg():
+        try:
+            result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True,
+                                    text=True, timeout=10, env=SPAWN_ENV,
+                                    creationflags=CREATE_NO_WINDOW)
+            listed = result.stdout if result.returncode == 0 else ''
+        except Exception as e:
+            logging.debug(f"Could not list ffmpeg encoders: {e}")
+            listed = ''
+        for name in _hw_encoder_candidates():
+            if name not in listed:
+                continue
+            trial = [
+                'ffmpeg', '-hide_banner', '-v', 'error',
+                '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.1',
+                '-c:v', name, '-f', 'null', '-'
+            ]
+            try:
+                proc = subprocess.run(trial, capture_output=True, timeout=15, env=SPAWN_ENV,
+                                      creationflags=CREATE_NO_WINDOW)
+                if proc.returncode == 0:
+                    logging.info(f"Using hardware H.264 encoder for ffmpeg: {name}")
+                    return name, _FFMPEG_H264_ENCODERS[name]
+            except Exception as e:
+                logging.debug(f"Trial encode with {name} failed: {e}")
+    return 'libx264', _FFMPEG_H264_ENCODERS['libx264']
+
+
+@contextlib.contextmanager
+def nvenc_session(encoder):
+    """Hold one of the NVENC session slots while an h264_nvenc encode runs.
+
+    Other encoders pass straight through. The GUI runs conversions from
+    several download threads, so every ffmpeg encode that may pick NVENC
+    goes through here (the PyAV fallback takes its slot directly).
+
+    Args:
+        encoder: Encoder name about to be used, or None for a stream copy
+    """
+    if encoder != 'h264_nvenc':
+        yield
+        return
+    with _NVENC_SESSIONS:
+        yield
+
+
+@functools.lru_cache(maxsize=1)
+def get_pyav_h264_encoder():
+    """Pick the fastest working H.264 encoder in PyAV's bundled FFmpeg.
+
+    Returns:
+        Tuple of (codec_name: str, codec_options: dict)
+    """
+    if HAS_PYAV:
+        _load_av()
+        for name in _hw_encoder_candidates():
+            try:
+                ctx = av.codec.CodecContext.create(name, 'w')
+                ctx.width = 256
+                ctx.height = 256
+                ctx.pix_fmt = 'yuv420p'
+                ctx.time_base = Fraction(1, 30)
+                ctx.open()
+                logging.info(f"Using hardware H.264 encoder for PyAV: {name}")
+                return name, dict(_PYAV_H264_OPTIONS[name])
+            except Exception as e:
+                logging.debug(f"PyAV encoder {name} unavailable: {e}")
+    return 'h264', dict(_PYAV_H264_OPTIONS['h264'])
+
+
+def _set_codec_threads(input_stream, output_stream):
+    """Enable threaded decode for a PyAV conversion.
+
+    PyAV decoders are single-threaded unless asked; frame+slice threading
+    ('AUTO') lets HEVC decode keep up with the encoder.
+    """
+    # A decoder reused across retries is already open and keeps its settings
+    if not input_stream.codec_context.is_open:
+        input_stream.thread_type = 'AUTO'
+
+
 def check_vlc():
     return HAS_VLC
 
 
+@functools.lru_cache(maxsize=1)
 def find_vlc_executable():
     if sys.platform == 'win32':
         vlc_paths = [
@@ -169,13 +689,134 @@ def find_vlc_executable():
     return None
 
 
-def validate_video_file(file_path, min_duration=0.1, min_size=1000):
-    """Validate video file using ffprobe or fallback to size check.
+def _mp4_box_layout_ok(fh, max_boxes=64):
+    """Walk the top-level box headers of an open MP4/MOV file.
+
+    Seeks past each payload, so only a few bytes are read however large the
+    file is. The first box must be one an MP4/QuickTime file starts with,
+    every box must fit inside the file, and a moov box must be present - a
+    truncated download or a damaged tag write fails on the last two.
+
+    Returns:
+        True if the box layout looks like a complete MP4
+    """
+    file_size = os.fstat(fh.fileno()).st_size
+    offset = 0
+    seen_moov = False
+    for index in range(max_boxes):
+        if offset == file_size:
+            break
+        fh.seek(offset)
+        header = fh.read(16)
+        if len(header) < 8:
+            return False
+        size, box_type = struct.unpack('>I4s', header[:8])
+        if index == 0 and box_type not in _MP4_LEADING_BOXES:
+            return False
+        if size == 1:
+            if len(header) < 16:
+                return False
+            size = struct.unpack('>Q', header[8:16])[0]
+        elif size == 0:
+            size = file_size - offset  # box runs to end of file
+        if size < 8 or offset + size > file_size:
+            return False
+        seen_moov = seen_moov or box_type == b'moov'
+        offset += size
+    return seen_moov
+
+
+def _quick_mp4_check(file_path, max_boxes=64):
+    """Structurally check an MP4/MOV without decoding or spawning ffprobe.
+
+    Returns:
+        True if the box layout looks like a complete MP4
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            return _mp4_box_layout_ok(f, max_boxes)
+    except OSError:
+        return False
+
+
+def read_mp4_duration(file_path, max_boxes=64):
+    """Read an MP4/MOV duration from its mvhd box without spawning ffprobe.
+
+    Seeks over the top-level boxes to moov, then over moov's children to
+    mvhd, so only a few dozen bytes are read however large the file is.
+
+    Args:
+        file_path: Path to video file
+        max_boxes: Maximum number of boxes to inspect at each level
+
+    Returns:
+        Duration in seconds, or None if the file isn't a readable MP4
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            end = os.fstat(f.fileno()).st_size
+            offset = 0
+            for wanted in (b'moov', b'mvhd'):
+                for _ in range(max_boxes):
+                    if offset + 8 > end:
+                        return None
+                    f.seek(offset)
+                    header = f.read(16)
+                    size, box_type = struct.unpack('>I4s', header[:8])
+                    header_size = 8
+                    if size == 1:
+                        if len(header) < 16:
+                            return None
+                        size = struct.unpack('>Q', header[8:16])[0]
+                        header_size = 16
+                    elif size == 0:
+                        size = end - offset  # box runs to end of its parent
+                    if size < header_size or offset + size > end:
+                        return None
+                    if box_type == wanted:
+                        break
+                    offset += size
+                else:
+                    return None
+                # Descend: children of moov, then the mvhd payload itself
+                end = offset + size
+                offset += header_size
+
+            f.seek(offset)
+            version = f.read(1)
+            if version == b'\x00':
+                # version(1) flags(3) creation(4) modification(4) timescale(4) duration(4)
+                data = f.read(19)
+                if len(data) < 19:
+                    return None
+                timescale, duration = struct.unpack('>II', data[11:19])
+                unknown = duration == 0xFFFFFFFF
+            elif version == b'\x01':
+                # version(1) flags(3) creation(8) modification(8) timescale(4) duration(8)
+                data = f.read(31)
+                if len(data) < 31:
+                    return None
+                timescale, duration = struct.unpack('>IQ', data[19:31])
+                unknown = duration == 0xFFFFFFFFFFFFFFFF
+            else:
+                return None
+            if not timescale or unknown:
+                return None
+            return duration / timescale
+    except OSError:
+        return None
+
+
+def validate_video_file(file_path, min_duration=0.1, min_size=1000, quick=False):
+    """Validate video file by probing it (PyAV or ffprobe) or fallback to size check.
     
     Args:
         file_path: Path to video file
         min_duration: Minimum duration in seconds (default 0.1)
         min_size: Minimum file size in bytes (default 1000)
+        quick: Only check size and MP4 box structure, skipping ffprobe.
+            For sanity checks that don't need duration/codec; a stream
+            is assumed present, so has_video is reported True.
         
     Returns:
         Tuple of (is_valid: bool, info: dict)
@@ -200,64 +841,81 @@ def validate_video_file(file_path, min_duration=0.1, min_size=1000):
         info['error'] = f'File too small: {file_size} bytes'
         return False, info
     
-    # Try ffprobe validation if available
-    if check_ffmpeg():
-        try:
-            # Get format info (duration)
-            cmd_format = [
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(file_path)
-            ]
-            result = subprocess.run(cmd_format, capture_output=True, text=True, timeout=10, creationflags=CREATE_NO_WINDOW)
-            if result.returncode == 0 and result.stdout.strip():
-                try:
-                    info['duration'] = float(result.stdout.strip())
-                except ValueError:
-                    pass
-            
-            # Get stream info
-            cmd_streams = [
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'stream=codec_type,codec_name',
-                '-of', 'json',
-                str(file_path)
-            ]
-            result = subprocess.run(cmd_streams, capture_output=True, text=True, timeout=10, creationflags=CREATE_NO_WINDOW)
-            if result.returncode == 0:
-                import json
-                data = json.loads(result.stdout)
-                for stream in data.get('streams', []):
-                    codec_type = stream.get('codec_type')
-                    if codec_type == 'video':
-                        info['has_video'] = True
-                        info['codec'] = stream.get('codec_name')
-                    elif codec_type == 'audio':
-                        info['has_audio'] = True
-            
-            # Validation logic
-            if not info['has_video']:
-                info['error'] = 'No video stream found'
-                return False, info
-            
-            if info['duration'] is not None and info['duration'] < min_duration:
-                info['error'] = f"Duration too short: {info['duration']}s"
-                return False, info
-            
-            logging.debug(f"Video validation passed: {file_path} - duration={info['duration']}s, codec={info['codec']}")
-            return True, info
-            
-        except subprocess.TimeoutExpired:
-            logging.warning(f"ffprobe validation timed out for {file_path}")
-        except Exception as e:
-            logging.debug(f"ffprobe validation error: {e}")
-    
-    # Fallback: if ffprobe not available or failed, just check size
+    if quick:
+        if not _quick_mp4_check(file_path):
+            info['error'] = 'Not a complete MP4 file'
+            return False, info
+        info['has_video'] = True
+        logging.debug(f"Video validation (quick): {file_path} - {file_size} bytes")
+        return True, info
+
+    # Probe if a backend is available (one cached probe for all fields)
+    if can_probe():
+        probe = probe_video(file_path)
+        if probe:
+            info['duration'] = probe['duration']
+            info['has_video'] = probe['has_video']
+            info['has_audio'] = probe['has_audio']
+            info['codec'] = probe['codec']
+
+        # Validation logic
+        if not info['has_video']:
+            info['error'] = 'No video stream found'
+            return False, info
+
+        if info['duration'] is not None and info['duration'] < min_duration:
+            info['error'] = f"Duration too short: {info['duration']}s"
+            return False, info
+
+        logging.debug(f"Video validation passed: {file_path} - duration={info['duration']}s, codec={info['codec']}")
+        return True, info
+
+    # Fallback: if no probe backend is available, just check size
     logging.debug(f"Video validation (size-only): {file_path} - {file_size} bytes")
     return True, info
 
 
+def _drain_tail(stream, tail, limit):
+    # Chunked rather than readline(): ffmpeg separates progress updates with
+    # '\r', so a long encode can be one enormous "line".
+    for chunk in iter(lambda: stream.read1(8192), b''):
+        tail += chunk
+        if len(tail) > 2 * limit:
+            del tail[:-limit]
+    stream.close()
+
+
+def _run_streaming(cmd, timeout, keep_bytes=256 * 1024, env=SPAWN_ENV):
+    """Run an ffmpeg/VLC command without buffering its whole stderr.
+
+    Transcoders write a progress update per frame; capture_output kept all of
+    it in memory until exit. Here stdout is discarded and a reader thread
+    keeps only the last ``keep_bytes`` of stderr for diagnostics. ``env``
+    defaults to the trimmed ffmpeg environment; pass None to inherit ours.
+
+    Returns:
+        subprocess.CompletedProcess with ``stderr`` set to the kept tail (str)
+
+    Raises:
+        subprocess.TimeoutExpired: after killing the process
+    """
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, env=env, creationflags=CREATE_NO_WINDOW)
+    tail = bytearray()
+    reader = threading.Thread(target=_drain_tail, args=(proc.stderr, tail, keep_bytes), daemon=True)
+    reader.start()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(timeout=5)
+    stderr_text = bytes(tail[-keep_bytes:]).decode('utf-8', errors='replace')
+    return subprocess.CompletedProcess(cmd, proc.returncode, None, stderr_text)
+
+
 def convert_with_vlc(input_path, output_path=None):
     """Convert video using VLC (Python bindings or subprocess).
     
@@ -293,6 +951,7 @@ def convert_with_vlc_python(input_path, output_path):
     
     try:
         logging.info(f"Converting with VLC (Python bindings): {input_path}")
+        _load_vlc()
         instance = vlc.Instance('--no-xlib')
         player = instance.media_player_new()
         media = instance.media_new(str(input_path))
@@ -307,43 +966,48 @@ def convert_with_vlc_python(input_path, output_path):
         media.add_option(f":sout={transcode_options}")
         media.add_option(":sout-keep")
         player.set_media(media)
-        player.play()
 
-        timeout = 300
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            state = player.get_state()
-            if state == vlc.State.Ended:
-                break
-            elif state == vlc.State.Error:
-                player.stop()
-                return False, "VLC conversion error"
-            time.sleep(0.5)
-        else:
+        # Wait on player events instead of polling get_state() every 0.5s
+        done = threading.Event()
+        errored = threading.Event()
+
+        def _on_end(event):
+            done.set()
+
+        def _on_error(event):
+            errored.set()
+            done.set()
+
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, _on_end)
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, _on_error)
+        try:
+            player.play()
+            finished = done.wait(300)
+        finally:
+            events.event_detach(vlc.EventType.MediaPlayerEndReached)
+            events.event_detach(vlc.EventType.MediaPlayerEncounteredError)
             player.stop()
-            if output_path.exists():
-                output_path.unlink()
+            player.release()
+            media.release()
+
+        if errored.is_set():
+            _safe_unlink(output_path)
+            return False, "VLC conversion error"
+        if not finished:
+            _safe_unlink(output_path)
             return False, "VLC conversion timed out"
 
-        player.stop()
-        player.release()
-        media.release()
-
         if output_path.exists() and output_path.stat().st_size > 1000:
             logging.info(f"VLC Python conversion successful: {output_path}")
             return True, output_path
         else:
-            if output_path.exists():
-                output_path.unlink()
+            _safe_unlink(output_path)
             return False, "VLC conversion failed"
 
     except Exception as e:
         logging.error(f"VLC Python conversion error: {e}", exc_info=True)
-        if output_path.exists():
-            try:
-                output_path.unlink()
-            except Exception:
-                pass
+        _safe_unlink(output_path)
         raise
 
 
@@ -375,11 +1039,11 @@ def convert_with_vlc_subprocess(input_path, output_path):
         "vlc://quit"
     ]
 
-    logging.debug(f"VLC command: {' '.join(cmd)}")
+    logging.debug("VLC command: %s", cmd)
     logging.info(f"Converting with VLC subprocess: {input_path} -> {output_path}")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
+        result = _run_streaming(cmd, timeout=300, env=None)  # VLC gets the full environment
         
         # Log stderr for debugging
         if result.stderr:
@@ -389,25 +1053,16 @@ def convert_with_vlc_subprocess(input_path, output_path):
             logging.info(f"VLC subprocess conversion successful: {output_path}")
             return True, output_path
         else:
-            if output_path.exists():
-                output_path.unlink()
+            _safe_unlink(output_path)
             logging.error(f"VLC subprocess conversion failed - output not created or too small")
             return False, "VLC subprocess conversion failed"
     except subprocess.TimeoutExpired:
         logging.error("VLC subprocess conversion timed out")
-        if output_path.exists():
-            try:
-                output_path.unlink()
-            except Exception:
-                pass
+        _safe_unlink(output_path)
         return False, "VLC subprocess timeout"
     except Exception as e:
         logging.error(f"VLC subprocess conversion error: {e}", exc_info=True)
-        if output_path.exists():
-            try:
-                output_path.unlink()
-            except Exception:
-                pass
+        _safe_unlink(output_path)
         return False, str(e)
 
 
@@ -424,17 +1079,24 @@ def set_video_metadata(file_path, date_obj, latitude, longitude, timezone_offset
     if not HAS_MUTAGEN:
         logging.debug("Skipping video metadata: mutagen not available")
         return False
+    from mutagen.mp4 import MP4
 
-    backup_path = f"{file_path}.backup"
-    try:
-        # Quick sanity check: file must exist and be reasonably sized
-        if not os.path.exists(file_path):
-            logging.error("Video file does not exist: %s", file_path)
-            return False
+    file_path = Path(file_path)
+    if not file_path.exists():
+        logging.error("Video file does not exist: %s", file_path)
+        return False
 
-        shutil.copy2(file_path, backup_path)
-        try:
-            video = MP4(file_path)
+    # Tags go into a copy that replaces the original only once it checks out:
+    # mutagen rewrites moov in place and may shift mdat, so a failed save can
+    # damage any part of the file. The copy shares blocks copy-on-write where
+    # the filesystem supports it.
+    temp_path = file_path.with_name(f"{file_path.stem}.tags_temp{file_path.suffix}")
+    try:
+        snap_utils.clone_file(file_path, temp_path)
+        # One handle serves the mutagen parse, the save and the check,
+        # instead of re-opening the file for each step
+        with open(temp_path, 'r+b') as fh:
+            video = MP4(fh)
             # Format with timezone offset for better app compatibility
             if timezone_offset:
                 creation_time = date_obj.strftime("%Y-%m-%dT%H:%M:%S") + timezone_offset
@@ -482,39 +1144,66 @@ def set_video_metadata(file_path, date_obj, latitude, longitude, timezone_offset
             else:
                 logging.info(f"No GPS data available for video (mutagen): {file_path}")
 
-            # write tags
-            video.save()
+            # write tags through the same handle
+            fh.seek(0)
+            video.save(fh)
+            fh.flush()
 
-            # verify by attempting to load the saved file with mutagen
-            try:
-                _ = MP4(file_path)
-            except Exception as e:
-                logging.error("Mutagen failed to re-open saved file, restoring backup: %s", e)
-                shutil.copy2(backup_path, file_path)
-                os.remove(backup_path)
+            # save() raises on errors it sees; walking the top-level boxes
+            # catches a truncated or overrun write without re-parsing moov
+            if not _mp4_box_layout_ok(fh):
+                logging.error("Saved file has a broken box layout, keeping the original: %s", file_path)
                 return False
 
-            os.remove(backup_path)
-            logging.info("Successfully set video metadata using mutagen: %s", file_path)
-            return True
-        except Exception as e:
-            logging.exception("Error writing mutagen metadata, restoring backup if any: %s", file_path)
-            if os.path.exists(backup_path):
-                try:
-                    shutil.copy2(backup_path, file_path)
-                    os.remove(backup_path)
-                except Exception:
-                    pass
-            return False
-
+        os.replace(temp_path, file_path)
+        logging.info("Successfully set video metadata using mutagen: %s", file_path)
+        return True
     except Exception:
-        logging.exception("Unexpected error in set_video_metadata for %s", file_path)
-        if os.path.exists(backup_path):
-            try:
-                os.remove(backup_path)
-            except Exception:
-                pass
+        logging.exception("Error writing mutagen metadata, keeping the original: %s", file_path)
         return False
+    finally:
+        _safe_unlink(temp_path)
+
+
+def ffmpeg_metadata_args(file_path, date_obj, latitude, longitude, timezone_offset=None):
+    """Build the ffmpeg -metadata/-movflags arguments for date and GPS tags."""
+    # Format with timezone offset
+    if timezone_offset:
+        creation_time_str = date_obj.strftime("%Y-%m-%dT%H:%M:%S") + timezone_offset
+    else:
+        creation_time_str = date_obj.strftime("%Y-%m-%dT%H:%M:%S")
+
+    # Also create a UTC version for the moov header (QuickTime standard)
+    # iCloud reads creation_time from moov.mvhd which expects UTC
+    if timezone_offset:
+        utc_creation_str = creation_time_str  # ffmpeg handles TZ conversion internally
+    else:
+        utc_creation_str = creation_time_str + "Z"
+
+    args = [
+        '-metadata', f'creation_time={utc_creation_str}',
+        '-metadata', f'date={creation_time_str}',
+        # Apple-specific metadata for iCloud/Apple Photos compatibility
+        # This is the primary tag iCloud uses for "date taken" on videos
+        '-metadata', f'com.apple.quicktime.creationdate={creation_time_str}',
+        # faststart keeps moov at the front so later tag reads only touch the header
+        '-movflags', '+use_metadata_tags+faststart',
+    ]
+
+    # Add location metadata if available
+    if latitude is not None and longitude is not None:
+        location_iso = f'{latitude:+.6f}{longitude:+.6f}/'
+        args.extend([
+            '-metadata', f'location={location_iso}',
+            '-metadata', f'location-eng={latitude}, {longitude}',
+            '-metadata', f'com.apple.quicktime.location.ISO6709={location_iso}',
+            '-metadata', f'com.apple.quicktime.GPS.latitude={latitude}',
+            '-metadata', f'com.apple.quicktime.GPS.longitude={longitude}'
+        ])
+        logging.info(f"Adding GPS metadata to video: lat={latitude}, lon={longitude}")
+    else:
+        logging.info(f"No GPS data available for video: {file_path}")
+    return args
 
 
 def set_video_metadata_ffmpeg(file_path, date_obj, latitude, longitude, timezone_offset=None):
@@ -531,84 +1220,85 @@ def set_video_metadata_ffmpeg(file_path, date_obj, latitude, longitude, timezone
         logging.debug("ffmpeg not available for metadata writing")
         return False
 
-    temp_output = None
+    temp_output = f"{file_path}.temp.mp4"
     try:
-        temp_output = f"{file_path}.temp.mp4"
-        # Format with timezone offset
-        if timezone_offset:
-            creation_time_str = date_obj.strftime("%Y-%m-%dT%H:%M:%S") + timezone_offset
-        else:
-            creation_time_str = date_obj.strftime("%Y-%m-%dT%H:%M:%S")
-        
-        # Also create a UTC version for the moov header (QuickTime standard)
-        # iCloud reads creation_time from moov.mvhd which expects UTC
-        utc_creation_str = date_obj.strftime("%Y-%m-%dT%H:%M:%S")
-        if timezone_offset:
-            utc_creation_str = creation_time_str  # ffmpeg handles TZ conversion internally
-        else:
-            utc_creation_str = creation_time_str + "Z"
-        
         cmd = [
             'ffmpeg', '-y', '-i', str(file_path), '-c', 'copy',
-            '-metadata', f'creation_time={utc_creation_str}',
-            '-metadata', f'date={creation_time_str}',
-            # Apple-specific metadata for iCloud/Apple Photos compatibility
-            # This is the primary tag iCloud uses for "date taken" on videos
-            '-metadata', f'com.apple.quicktime.creationdate={creation_time_str}',
-            '-movflags', '+use_metadata_tags',
+            *ffmpeg_metadata_args(file_path, date_obj, latitude, longitude, timezone_offset),
+            str(temp_output),
         ]
-        
-        # Add location metadata if available
-        if latitude is not None and longitude is not None:
-            location_iso = f'{latitude:+.6f}{longitude:+.6f}/'
-            cmd.extend([
-                '-metadata', f'location={location_iso}',
-                '-metadata', f'location-eng={latitude}, {longitude}',
-                '-metadata', f'com.apple.quicktime.location.ISO6709={location_iso}',
-                '-metadata', f'com.apple.quicktime.GPS.latitude={latitude}',
-                '-metadata', f'com.apple.quicktime.GPS.longitude={longitude}'
-            ])
-            logging.info(f"Adding GPS metadata to video: lat={latitude}, lon={longitude}")
-        else:
-            logging.info(f"No GPS data available for video: {file_path}")
-        
-        cmd.append(str(temp_output))
+        logging.debug("Setting video metadata with ffmpeg: %s", cmd)
+        result = _run_streaming(cmd, timeout=60)
+        if result.returncode == 0:
+            # Atomic swap; a missing temp file surfaces as FileNotFoundError
+            os.replace(temp_output, file_path)
+            logging.info(f"Successfully set video metadata using ffmpeg: {file_path}")
+            return True
+    except Exception as e:
+        logging.error(f"Failed to set video metadata with ffmpeg for {file_path}: {e}")
+    _safe_unlink(temp_output)
+    return False
 
-        logging.debug(f"Setting video metadata with ffmpeg: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60, creationflags=CREATE_NO_WINDOW)
 
-        if result.returncode == 0 and os.path.exists(temp_output):
-            try:
-                os.remove(file_path)
-                os.rename(temp_output, file_path)
-                logging.info(f"Successfully set video metadata using ffmpeg: {file_path}")
-                return True
-            except Exception as e:
-                logging.error(f"Failed to replace file after metadata update: {e}")
-                if os.path.exists(temp_output):
-                    os.remove(temp_output)
-                return False
-        else:
-            if os.path.exists(temp_output):
-                os.remove(temp_output)
-            return False
+def process_video_pipeline(file_path, date_obj, latitude, longitude, timezone_offset=None, timeout=300):
+    """Convert, rotate and tag a video in a single ffmpeg pass, in place.
+
+    Replaces the convert_hevc_to_h264 -> enforce_portrait_video ->
+    set_video_metadata_ffmpeg sequence, each of which rewrote the whole file.
+    One probe decides the plan: re-encode to H.264 (with ffmpeg auto-rotation)
+    when the codec isn't H.264 or rotation metadata is present, otherwise a
+    stream-copy remux that only writes the metadata.
+
+    Returns:
+        Tuple of (success: bool, result: 'transcoded'/'remuxed' or error_message: str)
+    """
+    if not check_ffmpeg():
+        return False, "ffmpeg not available"
+
+    file_path = sanitize_path(file_path)
+    info = probe_video(file_path)
+    if info is None or info['codec'] is None:
+        return False, "Could not probe video"
+
+    reencode = info['codec'] != 'h264' or info['rotation'] in (90, 180, 270)
+    temp_output = file_path.parent / f"{file_path.stem}.pipeline{file_path.suffix}"
+
+    cmd = ['ffmpeg', '-y']
+    encoder = None
+    if reencode:
+        encoder, encoder_args = get_ffmpeg_h264_encoder()
+        cmd += [*_FFMPEG_HWACCEL_ARGS, '-i', str(file_path), '-c:v', encoder, *encoder_args, '-metadata:s:v:0', 'rotate=0']
+    else:
+        cmd += ['-i', str(file_path), '-c:v', 'copy']
+    cmd += ['-c:a', 'copy',
+            *ffmpeg_metadata_args(file_path, date_obj, latitude, longitude, timezone_offset),
+            str(temp_output)]
+
+    logging.info(f"Single-pass video pipeline ({'transcode' if reencode else 'remux'}): {file_path}")
+    try:
+        with nvenc_session(encoder):
+            proc = _run_streaming(cmd, timeout=timeout)
+        if proc.returncode != 0:
+            logging.error(f"Video pipeline ffmpeg failed: {proc.stderr[-500:]}")
+            return False, f"ffmpeg failed: {proc.stderr[-200:]}"
+
+        is_valid, validation_info = validate_video_file(temp_output)
+        if not is_valid:
+            return False, f"Validation failed: {validation_info.get('error')}"
+
+        os.replace(temp_output, file_path)
+        return True, 'transcoded' if reencode else 'remuxed'
     except subprocess.TimeoutExpired:
-        if temp_output and os.path.exists(temp_output):
-            try:
-                os.remove(temp_output)
-            except Exception:
-                pass
-        return False
-    except Exception:
-        if temp_output and os.path.exists(temp_output):
-            try:
-                os.remove(temp_output)
-            except Exception:
-                pass
-        return False
+        logging.error(f"Video pipeline timed out after {timeout} seconds: {file_path}")
+        return False, "ffmpeg timed out"
+    except Exception as e:
+        logging.error(f"Video pipeline error: {e}", exc_info=True)
+        return False, str(e)
+    finally:
+        _safe_unlink(temp_output)
 
 
-def enforce_portrait_video(file_path, timeout=300):
+def enforce_portrait_video(file_path, timeout=300, force_pixel_rotation=True):
     """Apply rotation metadata to video frames so the file displays correctly.
     
     Only rotates when explicit rotation metadata (rotate tag or display matrix)
@@ -617,6 +1307,10 @@ def enforce_portrait_video(file_path, timeout=300):
     
     Uses ffmpeg auto-rotation (default) which is the most reliable approach
     across ffmpeg versions.
+
+    With force_pixel_rotation=False the file is left as it is: its display
+    matrix already rotates it in players that honour it, so there is nothing
+    to rewrite and no re-encode is needed.
     """
     if not os.path.exists(file_path):
         return False, "File not found"
@@ -629,6 +1323,10 @@ def enforce_portrait_video(file_path, timeout=300):
         # Genuinely landscape content should NOT be forced to portrait.
         return True, "No rotation needed"
 
+    if not force_pixel_rotation:
+        logging.info(f"enforce_portrait: keeping {rotation}° as display metadata for {file_path}")
+        return True, "Rotation kept as metadata"
+
     # Try ffmpeg first — let it auto-rotate naturally
     if check_ffmpeg():
         try:
@@ -636,41 +1334,28 @@ def enforce_portrait_video(file_path, timeout=300):
             # Let ffmpeg auto-rotate (default behaviour): it reads the display
             # matrix / rotate tag, applies the rotation during decode, and produces
             # output with correct orientation and no leftover rotation metadata.
+            encoder, encoder_args = get_ffmpeg_h264_encoder()
             ffmpeg_cmd = [
                 'ffmpeg', '-y',
+                *_FFMPEG_HWACCEL_ARGS,
                 '-i', file_path,
-                '-c:v', 'libx264', '-crf', '18', '-preset', 'veryfast',
+                '-c:v', encoder, *encoder_args,
                 '-c:a', 'copy',
                 '-metadata:s:v:0', 'rotate=0',   # Strip any leftover rotate tag
                 out_path
             ]
             logging.info(f"enforce_portrait: applying {rotation}° via ffmpeg auto-rotate")
-            proc = subprocess.run(ffmpeg_cmd, capture_output=True, text=True, timeout=timeout, creationflags=CREATE_NO_WINDOW)
+            with nvenc_session(encoder):
+                proc = _run_streaming(ffmpeg_cmd, timeout=timeout)
             if proc.returncode == 0 and os.path.exists(out_path) and os.path.getsize(out_path) > 1000:
                 try:
-                    backup = f"{file_path}.backup"
-                    shutil.move(file_path, backup)
-                    shutil.move(out_path, file_path)
-                    try:
-                        os.remove(backup)
-                    except Exception:
-                        pass
+                    _replace_original(out_path, file_path)
                     return True, file_path
                 except Exception as e:
-                    try:
-                        if os.path.exists(backup) and not os.path.exists(file_path):
-                            shutil.move(backup, file_path)
-                    except Exception:
-                        pass
-                    if os.path.exists(out_path):
-                        os.remove(out_path)
+                    _safe_unlink(out_path)
                     return False, f"Failed to replace original: {e}"
             else:
-                if os.path.exists(out_path):
-                    try:
-                        os.remove(out_path)
-                    except Exception:
-                        pass
+                _safe_unlink(out_path)
                 return False, f"ffmpeg failed: {proc.stderr}"
         except Exception as e:
             logging.debug(f"ffmpeg portrait enforcement error: {e}", exc_info=True)
@@ -678,6 +1363,7 @@ def enforce_portrait_video(file_path, timeout=300):
     # Fallback to PyAV if available — only rotate per metadata
     if HAS_PYAV:
         try:
+            _load_av()
             input_container = av.open(file_path)
             vstream = input_container.streams.video[0]
             coded_w = vstream.width
@@ -685,7 +1371,10 @@ def enforce_portrait_video(file_path, timeout=300):
 
             out_path = f"{file_path}.rotated{Path(file_path).suffix}"
             output_container = av.open(out_path, 'w')
-            output_vs = output_container.add_stream('h264', rate=vstream.average_rate)
+            codec_name, codec_options = get_pyav_h264_encoder()
+            output_vs = output_container.add_stream(codec_name, rate=vstream.average_rate)
+            output_vs.options = codec_options
+            _set_codec_threads(vstream, output_vs)
 
             if rotation in (90, 270):
                 output_vs.width = coded_h
@@ -694,6 +1383,7 @@ def enforce_portrait_video(file_path, timeout=300):
                 output_vs.width = coded_w
                 output_vs.height = coded_h
             output_vs.pix_fmt = 'yuv420p'
+            graph = _build_rotation_graph(vstream, rotation)
 
             output_audio = None
             if input_container.streams.audio:
@@ -702,30 +1392,16 @@ def enforce_portrait_video(file_path, timeout=300):
                 if hasattr(audio_stream, 'layout') and audio_stream.layout:
                     output_audio.layout = audio_stream.layout
 
-            for packet in input_container.demux():
-                if packet.stream.type == 'video':
-                    for frame in packet.decode():
-                        img = frame.to_image()
-                        if rotation == 90:
-                            try:
-                                img = img.transpose(PILImage.Transpose.ROTATE_270)
-                            except AttributeError:
-                                img = img.rotate(-90, expand=True)
-                        elif rotation == 270:
-                            try:
-                                img = img.transpose(PILImage.Transpose.ROTATE_90)
-                            except AttributeError:
-                                img = img.rotate(-270, expand=True)
-                        elif rotation == 180:
-                            try:
-                                img = img.transpose(PILImage.Transpose.ROTATE_180)
-                            except AttributeError:
-                                img = img.rotate(180, expand=True)
-                        new_frame = av.VideoFrame.from_image(img)
-                        for out_packet in output_vs.encode(new_frame):
+            # Demux only the streams we transcode; data/subtitle tracks are
+            # skipped inside libav. Decode + rotation run on a worker thread
+            # while this one encodes.
+            streams = [vstream, audio_stream] if output_audio else [vstream]
+            with _decode_ahead(input_container, streams, video_graph=graph) as decoded:
+                for kind, frame in decoded:
+                    if kind == 'video':
+                        for out_packet in output_vs.encode(frame):
                             output_container.mux(out_packet)
-                elif packet.stream.type == 'audio' and output_audio:
-                    for frame in packet.decode():
+                    elif output_audio:
                         for out_packet in output_audio.encode(frame):
                             output_container.mux(out_packet)
 
@@ -740,13 +1416,7 @@ def enforce_portrait_video(file_path, timeout=300):
 
             if os.path.exists(out_path) and os.path.getsize(out_path) > 1000:
                 try:
-                    backup = f"{file_path}.backup"
-                    shutil.move(file_path, backup)
-                    shutil.move(out_path, file_path)
-                    try:
-                        os.remove(backup)
-                    except Exception:
-                        pass
+                    _replace_original(out_path, file_path)
                     return True, file_path
                 except Exception as e:
                     return False, f"Failed to replace original after PyAV rotate: {e}"
@@ -791,77 +1461,117 @@ def _convert_with_ffmpeg(input_path, output_path=None):
         # 2. Output frames are in correct display orientation
         # 3. We strip the rotate tag just in case; the display matrix is consumed
         #    during auto-rotation and will not be written to the output.
+        encoder, encoder_args = get_ffmpeg_h264_encoder()
         cmd = [
             'ffmpeg', '-y',
+            *_FFMPEG_HWACCEL_ARGS,
             '-i', str(input_path),
-            '-c:v', 'libx264', '-crf', '18', '-preset', 'veryfast',
+            '-c:v', encoder, *encoder_args,
             '-c:a', 'copy',
             '-metadata:s:v:0', 'rotate=0',  # Strip any leftover rotate tag
             str(temp_output)
         ]
         
-        logging.info(f"ffmpeg conversion command (auto-rotate): {' '.join(cmd)}")
-        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=300, creationflags=CREATE_NO_WINDOW)
+        logging.info("ffmpeg conversion command (auto-rotate): %s", cmd)
+        with nvenc_session(encoder):
+            proc = _run_streaming(cmd, timeout=300)
         
         if proc.returncode != 0:
             logging.error(f"ffmpeg conversion failed: {proc.stderr}")
-            if temp_output.exists():
-                temp_output.unlink()
+            _safe_unlink(temp_output)
             return False, f"ffmpeg failed: {proc.stderr[:200]}"
         
         # Validate output
         is_valid, validation_info = validate_video_file(temp_output)
         if not is_valid:
             logging.warning(f"ffmpeg output validation failed: {validation_info.get('error')}")
-            if temp_output.exists():
-                temp_output.unlink()
+            _safe_unlink(temp_output)
             return False, f"Validation failed: {validation_info.get('error')}"
         
         # Atomic replace
         try:
-            os.replace(str(temp_output), str(output_path))
+            os.replace(temp_output, output_path)
             logging.info(f"ffmpeg conversion successful: {output_path}")
             return True, output_path
         except Exception as e:
             logging.error(f"Failed to replace file after ffmpeg conversion: {e}")
-            if temp_output.exists():
-                temp_output.unlink()
+            _safe_unlink(temp_output)
             return False, f"Failed to replace file: {e}"
     
     except subprocess.TimeoutExpired:
         logging.error("ffmpeg conversion timed out after 300 seconds")
-        if temp_output.exists():
-            try:
-                temp_output.unlink()
-            except Exception:
-                pass
+        _safe_unlink(temp_output)
         return False, "ffmpeg conversion timed out"
     except Exception as e:
         logging.error(f"ffmpeg conversion error: {e}", exc_info=True)
-        if temp_output.exists():
-            try:
-                temp_output.unlink()
-            except Exception:
-                pass
+        _safe_unlink(temp_output)
         return False, str(e)
 
 
+def _is_permanent_conversion_error(e):
+    """Whether a PyAV conversion error would recur on every retry.
+
+    Unreadable/corrupt input, a missing file or decoder, or no video stream
+    fail the same way each time, so retrying the whole decode+encode only
+    wastes minutes. Other errors (I/O hiccups, encoder session limits) may
+    be transient.
+    """
+    if isinstance(e, (FileNotFoundError, IndexError)):
+        return True
+    # av is still None if PyAV was never loaded, so e can't be one of its errors
+    if av is not None and isinstance(e, (av.error.InvalidDataError, av.error.DecoderNotFoundError)):
+        return True
+    return False
+
+
 def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_dir_path="downloads/failed_conversions"):
     """Convert video to H.264 using atomic temp file approach with validation.
+
+    Inputs that are already upright H.264 are not re-encoded: with no
+    output_path the input itself is returned, otherwise it is remuxed.
     
     Returns:
         Tuple of (success: bool, result: Path or error_message: str)
     """
     input_path = sanitize_path(input_path)
-    
-    if not HAS_PYAV:
-        logging.warning("PyAV not installed. Attempting ffmpeg then VLC fallback...")
-        # Try ffmpeg-based conversion with proper rotation handling first
+
+    # Already upright H.264: nothing to transcode. Hand back the input, or
+    # stream-copy into the requested output container.
+    info = probe_video(input_path)
+    if info and info['codec'] == 'h264' and not info['rotation']:
+        if output_path is None:
+            logging.info(f"Already H.264, skipping conversion: {input_path}")
+            return True, input_path
+        output_path = sanitize_path(output_path)
+        # probe_video doesn't need the ffmpeg CLI, so check for it first
         if check_ffmpeg():
-            success, result = _convert_with_ffmpeg(input_path, output_path)
-            if success:
-                return success, result
-            logging.warning("ffmpeg conversion failed, trying VLC...")
+            temp_output = output_path.parent / f"{output_path.stem}.temp{output_path.suffix}"
+            cmd = ['ffmpeg', '-y', '-i', str(input_path), '-map', '0', '-c', 'copy', str(temp_output)]
+            try:
+                result = _run_streaming(cmd, timeout=120)
+                if result.returncode == 0 and validate_video_file(temp_output)[0]:
+                    os.replace(temp_output, output_path)
+                    logging.info(f"Already H.264, remuxed without re-encoding: {output_path}")
+                    return True, output_path
+                remux_error = result.stderr[-500:]
+            except (OSError, subprocess.TimeoutExpired) as e:
+                remux_error = str(e)
+            _safe_unlink(temp_output)
+            logging.debug(f"Stream-copy remux failed, falling back to full conversion: {remux_error}")
+
+    # The ffmpeg CLI runs the whole decode/rotate/encode pipeline natively,
+    # with libx264's own frame threading (or a GPU encoder) and the audio
+    # stream-copied, so it goes first; PyAV is the fallback.
+    ffmpeg_tried = check_ffmpeg()
+    if ffmpeg_tried:
+        success, result = _convert_with_ffmpeg(input_path, output_path)
+        if success:
+            return success, result
+        if HAS_PYAV:
+            logging.warning(f"ffmpeg conversion failed, using PyAV: {result}")
+
+    if not HAS_PYAV:
+        logging.warning("PyAV not installed and ffmpeg unavailable or failed, trying VLC...")
         # Fall back to VLC (note: VLC preserves display matrix for player handling)
         return convert_with_vlc(input_path, output_path)
 
@@ -873,26 +1583,41 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
     
     # Always write to .temp file first
     temp_output = output_path.parent / f"{output_path.stem}.temp{output_path.suffix}"
-    
+
+    _load_av()
+    # Stringified once: the retry loop hands it to av.open up to twice per attempt
+    input_str = os.fspath(input_path)
+    _auto_rotated = None
     attempt = 0
+    # The input container survives retries: a retry rewinds it instead of
+    # re-opening the file and re-parsing the moov header.
+    input_container = None
     while attempt < max_attempts:
         attempt += 1
-        input_container = None
         output_container = None
         conversion_id = f"{input_path.stem}_{int(time.time())}_{attempt}"
+        nvenc_slot = False
         
         try:
-            logging.info(f"[{conversion_id}] Attempt {attempt}: Opening input video: {input_path}")
-            input_container = av.open(str(input_path))
+            if input_container is not None:
+                try:
+                    input_container.seek(0)
+                    logging.info(f"[{conversion_id}] Attempt {attempt}: Rewound input video: {input_path}")
+                except Exception as seek_error:
+                    logging.debug(f"[{conversion_id}] Rewind failed, re-opening input: {seek_error}")
+                    input_container.close()
+                    input_container = None
+            if input_container is None:
+                logging.info(f"[{conversion_id}] Attempt {attempt}: Opening input video: {input_path}")
+                _prefetch_file(input_path)
+                input_container = av.open(input_str)
             input_video_stream = input_container.streams.video[0]
 
             # Detect rotation metadata BEFORE opening output container
             rotation = _get_video_rotation(input_path)
             coded_w = input_video_stream.width
             coded_h = input_video_stream.height
-            needs_rotation = rotation in (90, 180, 270) and HAS_PIL
-            if rotation in (90, 180, 270) and not HAS_PIL:
-                logging.warning(f"[{conversion_id}] Video has {rotation}° rotation but PIL not available - orientation may be incorrect")
+            needs_rotation = rotation in (90, 180, 270)
             if needs_rotation:
                 logging.info(f"[{conversion_id}] Video has {rotation}° rotation metadata - will apply during conversion")
 
@@ -900,39 +1625,47 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
             # auto-rotated the frames (newer FFmpeg builds may do this).  If the
             # decoded frame dimensions differ from the coded stream dimensions
             # in a way consistent with the detected rotation, skip manual rotation
-            # to avoid double-rotating.
-            _auto_rotated = False
-            try:
-                _probe_container = av.open(str(input_path))
-                _probe_stream = _probe_container.streams.video[0]
-                for _probe_pkt in _probe_container.demux(_probe_stream):
-                    for _probe_frame in _probe_pkt.decode():
-                        fw, fh = _probe_frame.width, _probe_frame.height
-                        if rotation in (90, 270) and fw == coded_h and fh == coded_w:
-                            # Decoded frame has swapped dimensions → auto-rotation occurred
-                            _auto_rotated = True
-                            logging.info(
-                                f"[{conversion_id}] Auto-rotation detected: coded={coded_w}x{coded_h}, "
-                                f"decoded={fw}x{fh}. Skipping manual rotation to prevent double-rotate."
-                            )
-                        elif rotation == 180 and fw == coded_w and fh == coded_h:
-                            # 180° doesn't swap dimensions; check pixel content isn't feasible,
-                            # so we trust metadata and proceed with manual rotation.
-                            pass
-                        break  # only need first frame
-                    break
-                _probe_container.close()
-            except Exception as probe_err:
-                logging.debug(f"[{conversion_id}] Could not probe for auto-rotation: {probe_err}")
+            # to avoid double-rotating. The answer can't change between retries,
+            # so the extra open + decode only happens on the first attempt.
+            if _auto_rotated is None:
+                _auto_rotated = False
+                try:
+                    _probe_container = av.open(input_str)
+                    _probe_stream = _probe_container.streams.video[0]
+                    for _probe_pkt in _probe_container.demux(_probe_stream):
+                        for _probe_frame in _probe_pkt.decode():
+                            fw, fh = _probe_frame.width, _probe_frame.height
+                            if rotation in (90, 270) and fw == coded_h and fh == coded_w:
+                                # Decoded frame has swapped dimensions → auto-rotation occurred
+                                _auto_rotated = True
+                                logging.info(
+                                    f"[{conversion_id}] Auto-rotation detected: coded={coded_w}x{coded_h}, "
+                                    f"decoded={fw}x{fh}. Skipping manual rotation to prevent double-rotate."
+                                )
+                            elif rotation == 180 and fw == coded_w and fh == coded_h:
+                                # 180° doesn't swap dimensions; check pixel content isn't feasible,
+                                # so we trust metadata and proceed with manual rotation.
+                                pass
+                            break  # only need first frame
+                        break
+                    _probe_container.close()
+                except Exception as probe_err:
+                    logging.debug(f"[{conversion_id}] Could not probe for auto-rotation: {probe_err}")
 
             if _auto_rotated:
                 needs_rotation = False
                 rotation = 0  # Don't swap dims either
 
             logging.info(f"[{conversion_id}] Creating temp output: {temp_output}")
-            output_container = av.open(str(temp_output), 'w')
-
-            output_video_stream = output_container.add_stream('h264', rate=input_video_stream.average_rate)
+            output_container = av.open(os.fspath(temp_output), 'w')
+
+            codec_name, codec_options = get_pyav_h264_encoder()
+            output_video_stream = output_container.add_stream(codec_name, rate=input_video_stream.average_rate)
+            output_video_stream.options = codec_options
+            _set_codec_threads(input_video_stream, output_video_stream)
+            if codec_name == 'h264_nvenc':
+                _NVENC_SESSIONS.acquire()
+                nvenc_slot = True
             # Swap width/height for 90° or 270° rotation so portrait videos stay portrait
             if needs_rotation and rotation in (90, 270):
                 output_video_stream.width = coded_h
@@ -957,46 +1690,30 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
                 if hasattr(audio_stream, 'layout') and audio_stream.layout:
                     output_audio_stream.layout = audio_stream.layout
 
+            # Rotate in libavfilter (transpose/flip on YUV planes) rather
+            # than round-tripping every frame through an RGB PIL image.
+            # Sources that aren't yuv420p (10-bit HDR HEVC, full-range
+            # yuvj420p) get a format-only graph, so the conversion also runs
+            # on the decode thread instead of inside encode().
+            source_pix_fmt = input_video_stream.codec_context.pix_fmt
+            if needs_rotation:
+                rotation_graph = _build_rotation_graph(input_video_stream, rotation)
+            elif source_pix_fmt not in (None, 'yuv420p'):
+                rotation_graph = _build_rotation_graph(input_video_stream, 0)
+            else:
+                rotation_graph = None
+
             logging.info(f"[{conversion_id}] Processing frames...")
-            for packet in input_container.demux():
-                if packet.stream.type == 'video':
-                    for frame in packet.decode():
-                        if needs_rotation:
-                            # Apply rotation via PIL to preserve correct orientation
-                            # PIL's rotate() is counterclockwise, so we negate for clockwise
-                            try:
-                                img = frame.to_image()
-                                if rotation == 90:
-                                    # 90° CW = transpose ROTATE_270 in PIL
-                                    try:
-                                        img = img.transpose(PILImage.Transpose.ROTATE_270)
-                                    except AttributeError:
-                                        img = img.rotate(-90, expand=True)
-                                elif rotation == 270:
-                                    # 270° CW = transpose ROTATE_90 in PIL
-                                    try:
-                                        img = img.transpose(PILImage.Transpose.ROTATE_90)
-                                    except AttributeError:
-                                        img = img.rotate(-270, expand=True)
-                                elif rotation == 180:
-                                    try:
-                                        img = img.transpose(PILImage.Transpose.ROTATE_180)
-                                    except AttributeError:
-                                        img = img.rotate(180, expand=True)
-                                rotated_frame = av.VideoFrame.from_image(img)
-                                rotated_frame.pts = frame.pts
-                                rotated_frame.time_base = frame.time_base
-                                for out_packet in output_video_stream.encode(rotated_frame):
-                                    output_container.mux(out_packet)
-                            except Exception as rot_err:
-                                logging.warning(f"[{conversion_id}] Frame rotation failed, using original: {rot_err}")
-                                for out_packet in output_video_stream.encode(frame):
-                                    output_container.mux(out_packet)
-                        else:
-                            for out_packet in output_video_stream.encode(frame):
-                                output_container.mux(out_packet)
-                elif packet.stream.type == 'audio' and output_audio_stream:
-                    for frame in packet.decode():
+            demux_streams = [input_video_stream]
+            if audio_stream is not None:
+                demux_streams.append(audio_stream)
+            # Decode and rotate on the worker thread; this thread encodes + muxes
+            with _decode_ahead(input_container, demux_streams, video_graph=rotation_graph) as decoded:
+                for kind, frame in decoded:
+                    if kind == 'video':
+                        for out_packet in output_video_stream.encode(frame):
+                            output_container.mux(out_packet)
+                    elif output_audio_stream:
                         for out_packet in output_audio_stream.encode(frame):
                             output_container.mux(out_packet)
 
@@ -1007,10 +1724,7 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
                 for packet in output_audio_stream.encode():
                     output_container.mux(packet)
 
-            logging.info(f"[{conversion_id}] Closing containers...")
-            if input_container:
-                input_container.close()
-                input_container = None
+            logging.info(f"[{conversion_id}] Closing output container...")
             if output_container:
                 output_container.close()
                 output_container = None
@@ -1021,30 +1735,27 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
             
             if not is_valid:
                 logging.warning(f"[{conversion_id}] Validation failed: {validation_info.get('error')}")
-                if temp_output.exists():
-                    temp_output.unlink()
+                _safe_unlink(temp_output)
                 continue  # Retry
             
             # Validation passed - atomically replace
             logging.info(f"[{conversion_id}] Validation passed, performing atomic replace...")
+            input_container.close()
+            input_container = None
             try:
                 # Use os.replace for atomic operation (Windows: overwrites if exists)
-                os.replace(str(temp_output), str(output_path))
+                os.replace(temp_output, output_path)
                 logging.info(f"[{conversion_id}] Conversion successful: {output_path}")
+                _drop_page_cache(input_path)
+                _drop_page_cache(output_path)
                 return True, output_path
             except Exception as replace_error:
                 logging.error(f"[{conversion_id}] Failed to replace file: {replace_error}")
-                if temp_output.exists():
-                    temp_output.unlink()
+                _safe_unlink(temp_output)
                 return False, f"Failed to replace file: {replace_error}"
 
         except Exception as e:
             logging.error(f"[{conversion_id}] Error during conversion: {e}", exc_info=True)
-            try:
-                if input_container:
-                    input_container.close()
-            except Exception:
-                pass
             try:
                 if output_container:
                     output_container.close()
@@ -1057,14 +1768,34 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
                     logging.info(f"[{conversion_id}] Removed invalid temp file")
                 except Exception as cleanup_error:
                     logging.error(f"[{conversion_id}] Failed to remove temp file: {cleanup_error}")
-            
+
+            if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                # No fallback can write its output either
+                if input_container:
+                    input_container.close()
+                return False, f"Disk full while converting {input_path.name}"
+            if _is_permanent_conversion_error(e):
+                logging.warning(f"[{conversion_id}] Not retrying PyAV: {type(e).__name__} is not transient")
+                break
+
             time.sleep(0.5)
+        finally:
+            if nvenc_slot:
+                _NVENC_SESSIONS.release()
+
+    if input_container:
+        try:
+            input_container.close()
+        except Exception:
+            pass
 
-    # All PyAV attempts exhausted - try ffmpeg direct, then VLC fallback
-    logging.info(f"All PyAV attempts failed for {input_path}. Trying ffmpeg direct conversion...")
+    # All PyAV attempts exhausted - try ffmpeg direct (unless it already
+    # failed above; a second full transcode would fail the same way), then VLC
+    logging.info(f"All PyAV attempts failed for {input_path}")
     
     # Try ffmpeg direct conversion (handles rotation properly)
-    if check_ffmpeg():
+    if not ffmpeg_tried and check_ffmpeg():
+        logging.info("Trying ffmpeg direct conversion...")
         ffmpeg_success, ffmpeg_result = _convert_with_ffmpeg(input_path, output_path)
         if ffmpeg_success:
             return ffmpeg_success, ffmpeg_result
@@ -1087,11 +1818,7 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
             if rotation in (90, 180, 270) and check_ffmpeg():
                 logging.info(f"VLC output has {rotation}° rotation - applying via ffmpeg post-process...")
                 ffmpeg_fix_success, ffmpeg_fix_result = _convert_with_ffmpeg(vlc_temp, output_path)
-                if vlc_temp.exists():
-                    try:
-                        vlc_temp.unlink()
-                    except Exception:
-                        pass
+                _safe_unlink(vlc_temp)
                 if ffmpeg_fix_success:
                     logging.info(f"VLC + ffmpeg rotation fix successful: {output_path}")
                     return True, output_path
@@ -1107,42 +1834,42 @@ def convert_hevc_to_h264(input_path, output_path=None, max_attempts=3, failed_di
             # No rotation needed or ffmpeg not available - use VLC output directly
             if vlc_temp.exists():
                 try:
-                    os.replace(str(vlc_temp), str(output_path))
+                    os.replace(vlc_temp, output_path)
                     logging.info(f"VLC fallback conversion successful: {output_path}")
                     return True, output_path
                 except Exception as e:
                     logging.error(f"Failed to replace after VLC conversion: {e}")
-                    if vlc_temp.exists():
-                        vlc_temp.unlink()
+                    _safe_unlink(vlc_temp)
         else:
             logging.warning(f"VLC conversion validation failed: {validation_info.get('error')}")
-            if vlc_temp.exists():
-                vlc_temp.unlink()
+            _safe_unlink(vlc_temp)
 
-    # Complete failure - move to failed_conversions with logs
+    # Complete failure - copy to failed_conversions with logs
     failed_dir = Path(failed_dir_path)
     failed_dir.mkdir(parents=True, exist_ok=True)
     failed_path = failed_dir / input_path.name
 
+    # Copied, not moved: the caller keeps the original in the download
+    # folder (with its timestamps set) when conversion fails
+    try:
+        if not failed_path.exists():
+            snap_utils.clone_file(input_path, failed_path)
+            logging.info(f"Copied failed file to: {failed_path}")
+    except OSError as copy_error:
+        logging.error(f"Failed to copy {input_path} to {failed_path}: {copy_error}")
+
     error_log_path = failed_dir / f"{input_path.stem}_error_{int(time.time())}.log"
     try:
         with open(error_log_path, 'w', encoding='utf-8') as f:
-            f.write(f"Failed conversion: {input_path}\\n")
-            f.write(f"PyAV: Failed after {max_attempts} attempts\\n")
-            f.write(f"VLC: {vlc_result if not vlc_success else 'Failed validation'}\\n")
-            f.write(f"Timestamp: {datetime.now().isoformat()}\\n")
+            f.write(f"Failed conversion: {input_path}\n")
+            f.write(f"PyAV: Failed after {attempt} attempts\n")
+            f.write(f"VLC: {vlc_result if not vlc_success else 'Failed validation'}\n")
+            f.write(f"Timestamp: {datetime.now().isoformat()}\n")
             if isinstance(vlc_result, str):
-                f.write(f"\\nVLC Error Details:\\n{vlc_result}\\n")
+                f.write(f"\nVLC Error Details:\n{vlc_result}\n")
         logging.info(f"Saved error log: {error_log_path}")
-    except Exception as log_error:
+    except OSError as log_error:
         logging.error(f"Failed to save error log: {log_error}")
 
-    try:
-        if not failed_path.exists():
-            shutil.copy2(input_path, failed_path)
-            logging.info(f"Copied failed file to: {failed_path}")
-    except Exception as copy_error:
-        logging.error(f"Failed to copy {input_path} to {failed_path}: {copy_error}")
-
     logging.error(f"All conversion attempts failed for {input_path}")
-    return False, f"Failed after {max_attempts} PyAV attempts and VLC fallback"
\ No newline at end of file
+    return False, f"Failed after {attempt} PyAV attempts and VLC fallback"
@@ -1,14 +1,22 @@
+import errno
+import functools
+import io
 import logging
 import shutil
 import os
 from pathlib import Path
 import zipfile
+from collections import defaultdict, deque
 import tempfile
 import re
 import sys
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+import video_utils
+
 # Windows-specific subprocess flag to prevent command windows from popping up
 CREATE_NO_WINDOW = 0x08000000 if sys.platform == 'win32' else 0
 
@@ -20,24 +28,100 @@ try:
 except Exception:
     HAS_PIL = False
 
+# Media a Snapchat ZIP can carry
+MEDIA_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.mp4', '.mov', '.m4v', '.heic'})
+
+# Last "time=HH:MM:SS.xx" in ffmpeg's progress output
+_FFMPEG_TIME_PATTERN = re.compile(r'time=(\d+):(\d+):(\d+(?:\.\d+)?)')
+
+# -main/-overlay member names, compiled once rather than per archive
+_MAIN_PATTERN = re.compile(r'-main\.[^.]+$', re.IGNORECASE)
+_OVERLAY_PATTERN = re.compile(r'-overlay\.[^.]+$', re.IGNORECASE)
+
+# Container extensions merged with ffmpeg rather than PIL
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.avi', '.mkv')
+
+# libx264 preset for overlay merges. The merged clip is the final output, so
+# the default matches HEVC conversions; 'superfast'/'ultrafast' encode 2-3x
+# faster for noticeably larger files at the same CRF.
+OVERLAY_X264_PRESET = 'veryfast'
+
+# Serializes collision-free renames of concurrently merged pairs
+_RENAME_LOCK = threading.Lock()
+
+# RAM-backed scratch space (Linux) for video members ffmpeg reads back
+_RAM_SCRATCH_DIR = '/dev/shm'
+
+
+def _is_media(name):
+    return os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS
+
+
+def _scratch_parent(needed_bytes):
+    """Pick a parent folder for extracted video members.
+
+    /dev/shm keeps them in RAM, but it is often small (64 MB in Docker), so
+    it is only used while it has twice the needed space free.
+
+    Returns:
+        '/dev/shm', or None for the default temp directory
+    """
+    try:
+        if (os.access(_RAM_SCRATCH_DIR, os.W_OK)
+                and shutil.disk_usage(_RAM_SCRATCH_DIR).free >= 2 * needed_bytes):
+            return _RAM_SCRATCH_DIR
+    except OSError:
+        pass
+    return None
+
+
+def _extract_members(zip_ref, names, temp_dir, pool):
+    """Extract names into temp_dir on pool, raising the first failure.
+
+    zlib releases the GIL, so members inflate in parallel. Parent folders
+    are made up front: zipfile's own makedirs isn't race-safe. Every
+    extraction finishes before an error is raised, so the caller can safely
+    remove temp_dir.
+    """
+    for name in names:
+        (temp_dir / name).parent.mkdir(parents=True, exist_ok=True)
+    futures = [pool.submit(zip_ref.extract, name, temp_dir) for name in names]
+    wait(futures)
+    for future in futures:
+        future.result()
+
+
+def _copy_member(zip_ref, member, output_path):
+    """Inflate one ZIP member straight to output_path, removing it on failure."""
+    try:
+        with zip_ref.open(member) as src, open(output_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    except BaseException:
+        Path(output_path).unlink(missing_ok=True)
+        raise
+
 
 def extract_media_from_zip(zip_path, output_path):
-    temp_dir = None
     try:
         logging.info(f"Extracting media from ZIP: {zip_path}")
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            file_list = zip_ref.namelist()
-            media_extensions = ('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.m4v', '.heic')
-            media_files = [f for f in file_list if f.lower().endswith(media_extensions)]
-            if not media_files:
-                logging.warning(f"No media files found in ZIP archive")
+            # Stop at the first video; otherwise keep the first image. A video
+            # memory's ZIP also holds its PNG overlay, which must not win.
+            media_file = None
+            for info in zip_ref.infolist():
+                ext = os.path.splitext(info.filename)[1].lower()
+                if ext not in MEDIA_EXTENSIONS:
+                    continue
+                if ext in VIDEO_EXTENSIONS:
+                    media_file = info
+                    break
+                if media_file is None:
+                    media_file = info
+            if media_file is None:
+                logging.warning("No media files found in ZIP archive")
                 return False
-            media_file = media_files[0]
-            logging.info(f"Extracting: {media_file}")
-            temp_dir = Path(output_path).parent / "temp_extract"
-            temp_dir.mkdir(exist_ok=True)
-            extracted_path = zip_ref.extract(media_file, temp_dir)
-            shutil.move(extracted_path, output_path)
+            logging.info(f"Extracting: {media_file.filename}")
+            _copy_member(zip_ref, media_file, output_path)
             logging.info(f"Successfully extracted media to: {output_path}")
             return True
     except zipfile.BadZipFile as e:
@@ -46,12 +130,6 @@ def extract_media_from_zip(zip_path, output_path):
     except Exception as e:
         logging.warning(f"Error extracting ZIP: {e}")
         return False
-    finally:
-        if temp_dir and temp_dir.exists():
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as cleanup_error:
-                logging.debug(f"Could not clean up temp directory: {cleanup_error}")
 
 
 def extract_original_from_zip(zip_path, output_path):
@@ -68,36 +146,27 @@ def extract_original_from_zip(zip_path, output_path):
     Returns:
         True on success, False on failure.
     """
-    temp_dir = None
     try:
         logging.info(f"Extracting original (-main) media from ZIP: {zip_path}")
-        main_pattern = re.compile(r'-main\.[^.]+$', re.IGNORECASE)
-        media_extensions = ('.jpg', '.jpeg', '.png', '.mp4', '.mov', '.m4v', '.heic')
 
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             file_list = [n for n in zip_ref.namelist() if not n.endswith('/')]
 
             # Prefer -main files (the original without overlay)
-            main_files = [f for f in file_list if main_pattern.search(f)
-                          and f.lower().endswith(media_extensions)]
+            main_files = [f for f in file_list if _MAIN_PATTERN.search(f) and _is_media(f)]
             if main_files:
                 media_file = main_files[0]
             else:
                 # Fallback: first non-overlay media file
-                overlay_pattern = re.compile(r'-overlay\.[^.]+$', re.IGNORECASE)
                 media_files = [f for f in file_list
-                               if f.lower().endswith(media_extensions)
-                               and not overlay_pattern.search(f)]
+                               if _is_media(f) and not _OVERLAY_PATTERN.search(f)]
                 if not media_files:
                     logging.warning("No original media files found in ZIP archive")
                     return False
                 media_file = media_files[0]
 
             logging.info(f"Extracting original: {media_file}")
-            temp_dir = Path(output_path).parent / "temp_extract_original"
-            temp_dir.mkdir(exist_ok=True)
-            extracted_path = zip_ref.extract(media_file, temp_dir)
-            shutil.move(extracted_path, output_path)
+            _copy_member(zip_ref, media_file, output_path)
             logging.info(f"Successfully extracted original media to: {output_path}")
             return True
 
@@ -107,41 +176,104 @@ def extract_original_from_zip(zip_path, output_path):
     except Exception as e:
         logging.warning(f"Error extracting original from ZIP: {e}")
         return False
-    finally:
-        if temp_dir and temp_dir.exists():
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as cleanup_error:
-                logging.debug(f"Could not clean up temp directory: {cleanup_error}")
+
+
+def _is_blank_overlay(img):
+    """Whether an overlay image is fully transparent (a caption-less export)."""
+    if 'A' not in img.getbands() and 'transparency' not in img.info:
+        return False
+    # RGBA overlays (the usual case) are read in place; only palette or LA
+    # images pay for a converted copy
+    rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+    return rgba.getchannel('A').getextrema()[1] == 0
 
 
 def merge_images(main_img_path, overlay_img_path, output_path):
+    """Composite an overlay image on top of a main image.
+
+    Args:
+        main_img_path: Path or binary file object of the main image
+        overlay_img_path: Path or binary file object of the overlay image
+        output_path: Path to save the merged image
+
+    Returns:
+        Tuple of (success: bool, output_path or error message)
+    """
     if not HAS_PIL:
         logging.error("Pillow is not installed; cannot merge images")
         return False, "Pillow not installed"
 
     try:
         # Apply EXIF orientation before compositing so both images
-        # are in correct display orientation (prevents landscape/portrait mismatch)
-        main_raw = PILImage.open(main_img_path)
-        main_raw = PILImageOps.exif_transpose(main_raw) or main_raw
-        main = main_raw.convert('RGBA')
-
-        overlay_raw = PILImage.open(overlay_img_path)
-        overlay_raw = PILImageOps.exif_transpose(overlay_raw) or overlay_raw
-        overlay = overlay_raw.convert('RGBA')
-
-        if overlay.size != main.size:
-            overlay = overlay.resize(main.size, PILImage.LANCZOS)
+        # are in correct display orientation (prevents landscape/portrait mismatch).
+        # The with-blocks close the source files as soon as the pixels are
+        # decoded; intermediates are dropped as soon as they are replaced.
+        with PILImage.open(overlay_img_path) as overlay_file:
+            if _is_blank_overlay(overlay_file):
+                # Nothing to draw: keep the original bytes instead of re-encoding
+                logging.info("Overlay is fully transparent; copying the main image unchanged")
+                if hasattr(main_img_path, 'read'):
+                    main_img_path.seek(0)
+                    with open(output_path, 'wb') as f:
+                        shutil.copyfileobj(main_img_path, f)
+                else:
+                    shutil.copyfile(main_img_path, output_path)
+                return True, output_path
+            with PILImage.open(main_img_path) as main_file:
+                main_raw = PILImageOps.exif_transpose(main_file) or main_file
+                main_raw.load()
+
+            if (overlay_file.format == 'JPEG' and overlay_file.size != main_raw.size
+                    and overlay_file.getexif().get(0x0112, 1) == 1):
+                # Let libjpeg decode a DCT-downscaled image (1/2, 1/4, 1/8) no
+                # smaller than the target, so fewer pixels reach the resize
+                overlay_file.draft('RGB', main_raw.size)
+            overlay = PILImageOps.exif_transpose(overlay_file) or overlay_file
+            if overlay.mode != 'RGBA':
+                # convert() copies even to the same mode; PNG overlays are usually RGBA already
+                overlay = overlay.convert('RGBA')
+
+        if overlay.size != main_raw.size:
+            width, height = main_raw.size
+            factor = overlay.size[0] // width
+            if factor >= 2 and overlay.size == (width * factor, height * factor):
+                # Exact 2x/3x assets: a box reduce averages each block in one pass
+                overlay = overlay.reduce(factor)
+            else:
+                # Captions and stickers don't need a windowed-sinc filter on
+                # large frames; bilinear is several times cheaper there
+                resample = PILImage.BILINEAR if width * height > 4_000_000 else PILImage.LANCZOS
+                overlay = overlay.resize(main_raw.size, resample)
 
-        merged = PILImage.alpha_composite(main, overlay)
         ext = Path(output_path).suffix.lower()
+        if 'A' not in main_raw.getbands() and 'transparency' not in main_raw.info:
+            # Opaque main (every Snapchat JPEG): a masked paste blends the
+            # overlay in place in one pass, without RGBA copies of the main
+            # image or a second pass onto a white background. An RGB main
+            # is already a private decoded copy, so it is drawn on directly.
+            merged = main_raw if main_raw.mode == 'RGB' else main_raw.convert('RGB')
+            del main_raw
+            merged.paste(overlay, (0, 0), overlay)
+            del overlay
+            if ext in ['.jpg', '.jpeg']:
+                merged.save(output_path, quality=95)
+            else:
+                merged.save(output_path)
+            return True, output_path
+
+        main = main_raw if main_raw.mode == 'RGBA' else main_raw.convert('RGBA')
+        del main_raw
         if ext in ['.jpg', '.jpeg']:
-            bg = PILImage.new('RGB', merged.size, (255, 255, 255))
-            bg.paste(merged, mask=merged.split()[3])
+            # "Over" is associative, so pasting main then overlay onto white
+            # equals flattening their composite, without the RGBA intermediate
+            bg = PILImage.new('RGB', main.size, (255, 255, 255))
+            bg.paste(main, (0, 0), main)
+            del main
+            bg.paste(overlay, (0, 0), overlay)
+            del overlay
             bg.save(output_path, quality=95)
         else:
-            merged.save(output_path)
+            PILImage.alpha_composite(main, overlay).save(output_path)
 
         return True, output_path
     except Exception as e:
@@ -149,165 +281,318 @@ def merge_images(main_img_path, overlay_img_path, output_path):
         return False, str(e)
 
 
-def merge_video_overlay(main_video_path, overlay_image_path, output_path):
+@functools.lru_cache(maxsize=1)
+def _cuda_overlay_available():
+    """Whether ffmpeg can run the overlay graph on an NVIDIA GPU.
+
+    Needs NVENC to have passed the encoder trial plus the CUDA hwaccel and
+    overlay_cuda filter in this ffmpeg build. Probed once per process.
+    """
+    if video_utils.get_ffmpeg_h264_encoder()[0] != 'h264_nvenc':
+        return False
+    try:
+        hwaccels = subprocess.run(['ffmpeg', '-hide_banner', '-hwaccels'], capture_output=True,
+                                  text=True, timeout=10, env=video_utils.SPAWN_ENV,
+                                  creationflags=CREATE_NO_WINDOW).stdout
+        filters = subprocess.run(['ffmpeg', '-hide_banner', '-filters'], capture_output=True,
+                                 text=True, timeout=10, env=video_utils.SPAWN_ENV,
+                                 creationflags=CREATE_NO_WINDOW).stdout
+    except Exception as e:
+        logging.debug(f"Could not query ffmpeg CUDA support: {e}")
+        return False
+    return 'cuda' in hwaccels.split() and ' overlay_cuda ' in filters
+
+
+def _ffmpeg_output_duration(stderr_text):
+    """Seconds of media ffmpeg reported writing, or None if it printed no time."""
+    matches = _FFMPEG_TIME_PATTERN.findall(stderr_text)
+    if not matches:
+        return None
+    hours, minutes, seconds = matches[-1]
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _drain_progress(pipe, tail):
+    """Collect ffmpeg's stderr lines into ``tail``, logging progress lines."""
+    # Text mode turns ffmpeg's carriage-return updates into separate lines
+    try:
+        for line in pipe:
+            tail.append(line)
+            # Log progress lines (they contain 'time=' or 'frame=')
+            if 'time=' in line or 'frame=' in line:
+                logging.debug(f"ffmpeg progress: {line.strip()}")
+    except Exception as read_error:
+        logging.warning(f"Error reading ffmpeg output: {read_error}")
+    finally:
+        pipe.close()
+
+
+def _feed_stdin(pipe, data):
+    """Write data to a child's stdin and close it; an early exit is ignored."""
+    try:
+        pipe.buffer.write(data)
+        pipe.close()
+    except (OSError, ValueError):
+        pass
+
+
+def _run_ffmpeg_with_progress(cmd, timeout=300, keep_lines=200, input_data=None):
+    """Run an ffmpeg merge, logging its progress lines at debug level.
+
+    Only errors and the -stats progress lines are requested from ffmpeg, and
+    just the last ``keep_lines`` of them are kept for diagnostics.
+
+    Args:
+        cmd: ffmpeg command list
+        timeout: Seconds before ffmpeg is killed
+        keep_lines: Number of stderr lines kept
+        input_data: Bytes fed to ffmpeg's stdin (for a ``-i -`` input)
+
+    Returns:
+        Tuple of (returncode: int, stderr_text: str)
+
+    Raises:
+        subprocess.TimeoutExpired: after killing the process
+    """
+    cmd = [cmd[0], '-hide_banner', '-loglevel', 'error', '-stats', *cmd[1:]]
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL if input_data is None else subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=video_utils.SPAWN_ENV,
+        creationflags=CREATE_NO_WINDOW
+    )
+    if input_data is not None:
+        # Fed from a thread too, so a stalled ffmpeg can't block past the timeout
+        threading.Thread(target=_feed_stdin, args=(proc.stdin, input_data), daemon=True).start()
+
+    # Drain stderr on a helper thread so the timeout below is enforced even
+    # if ffmpeg hangs without closing the pipe
+    stderr_tail = deque(maxlen=keep_lines)
+    reader = threading.Thread(target=_drain_progress, args=(proc.stderr, stderr_tail), daemon=True)
+    reader.start()
+
+    # Wait for completion with timeout
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(timeout=5)
+
+    return proc.returncode, ''.join(stderr_tail)
+
+
+def merge_video_overlay(main_video_path, overlay_image_path, output_path,
+                        date_obj=None, latitude=None, longitude=None, timezone_offset=None,
+                        use_gpu=True, encoder_threads=None):
     """Overlay an image (caption) on top of a video using ffmpeg.
     
     CRITICAL FIX: Uses loop filter to repeat the overlay image for the entire video duration.
     Without this, ffmpeg takes the duration of the shortest input (1 second for a static image),
     resulting in a 1-second output video.
+
+    When date_obj is given, the date/GPS tags are written by the same ffmpeg
+    run, so the merged file doesn't need a second remux just for metadata.
+
+    With use_gpu on an NVENC machine, unrotated clips are decoded, overlaid
+    and encoded on the GPU; if that run fails the CPU graph is used instead.
+
+    encoder_threads caps the encoder's thread count when several merges run
+    at once; by default the encoder uses every core.
     
     Returns (True, output_path) on success or (False, error_message).
     """
-    normalized_overlay = None
+    overlay_raw = None
+    overlay_blank = False
+    overlay_fits = False
+    probe = None
     try:
-        import shutil
-        import subprocess
-        if shutil.which('ffmpeg') is None:
+        if not video_utils.check_ffmpeg():
             logging.warning("ffmpeg not found; cannot merge video overlay")
             return False, "ffmpeg not found"
 
-        # Normalize overlay image to proper PNG format using Pillow
+        # The overlay has to cover the frame as ffmpeg shows it (after
+        # autorotate), so a 90/270 clip swaps its coded width and height
+        display_size = None
+        if HAS_PIL:
+            probe = video_utils.probe_video(main_video_path)
+            if probe and probe.get('width') and probe.get('height'):
+                display_size = (probe['width'], probe['height'])
+                if probe.get('rotation') in (90, 270):
+                    display_size = display_size[::-1]
+
+        # Normalize overlay image using Pillow
         # This handles WebP, JPEG, and other formats that may have wrong extensions
-        # or cause issues with ffmpeg's -loop flag
+        # by handing ffmpeg the decoded RGBA pixels on stdin instead of a file,
+        # resized once here rather than by a scale filter on every frame
+        overlay_input = ['-i', str(overlay_image_path)]
         if HAS_PIL:
             try:
                 logging.debug(f"Normalizing overlay image format: {overlay_image_path}")
-                img = PILImage.open(overlay_image_path)
-                # Create a temporary PNG file in the same directory
-                temp_dir = Path(overlay_image_path).parent
-                normalized_overlay = temp_dir / f"{Path(overlay_image_path).stem}_normalized.png"
-                img.save(normalized_overlay, format='PNG')
-                logging.debug(f"Normalized overlay saved to: {normalized_overlay}")
-                # Use the normalized image for ffmpeg
-                overlay_to_use = str(normalized_overlay)
+                with PILImage.open(overlay_image_path) as img:
+                    overlay_blank = _is_blank_overlay(img)
+                    overlay_fits = display_size is not None
+                    if (img.format == 'PNG' and Path(overlay_image_path).suffix.lower() == '.png'
+                            and (display_size is None or img.size == display_size)):
+                        # Already what ffmpeg needs (Snapchat's usual overlay);
+                        # decoding it here would only copy the pixels twice
+                        logging.debug("Overlay is already a PNG, passing it to ffmpeg as is")
+                    else:
+                        rgba = img if img.mode == 'RGBA' else img.convert('RGBA')
+                        if display_size and rgba.size != display_size:
+                            rgba = rgba.resize(display_size, PILImage.LANCZOS)
+                        overlay_raw = rgba.tobytes()
+                        overlay_input = [
+                            '-f', 'rawvideo', '-pixel_format', 'rgba',
+                            '-video_size', f"{rgba.width}x{rgba.height}",
+                            '-i', '-',
+                        ]
+                        logging.debug(f"Piping normalized {rgba.width}x{rgba.height} overlay to ffmpeg")
             except Exception as normalize_error:
                 logging.warning(f"Could not normalize overlay image, using original: {normalize_error}")
-                overlay_to_use = str(overlay_image_path)
+                overlay_raw = None
+                overlay_fits = False
+                overlay_input = ['-i', str(overlay_image_path)]
         else:
             logging.debug("Pillow not available, using original overlay image")
-            overlay_to_use = str(overlay_image_path)
 
-        # First, get the duration of the main video to know how long to loop the overlay
-        try:
-            probe_cmd = [
-                'ffprobe', '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                str(main_video_path)
-            ]
-            probe_result = subprocess.run(
-                probe_cmd, capture_output=True, text=True, 
-                timeout=10, creationflags=CREATE_NO_WINDOW
-            )
-            video_duration = float(probe_result.stdout.strip())
+        # First, get the duration of the main video to know how long to loop the overlay.
+        # Snapchat clips are MP4, so the mvhd box usually has it without a subprocess;
+        # a probe is only needed for codec/rotation/size or when that read fails.
+        if probe is None and (overlay_blank or (use_gpu and _cuda_overlay_available())):
+            probe = video_utils.probe_video(main_video_path)
+        video_duration = video_utils.read_mp4_duration(main_video_path)
+        if video_duration is None and probe is None:
+            probe = video_utils.probe_video(main_video_path)
+        if video_duration is None and probe:
+            video_duration = probe['duration']
+        if video_duration is not None:
             logging.info(f"Main video duration: {video_duration} seconds")
-        except Exception as probe_error:
-            logging.warning(f"Could not determine video duration, using default loop: {probe_error}")
-            video_duration = None
+        else:
+            logging.warning("Could not determine video duration, using default loop")
 
         # Build ffmpeg command with proper overlay scaling
         # ffmpeg auto-rotates videos based on metadata by default (-autorotate is on),
         # so the video frames entering the filter graph are already in correct orientation.
-        # We only need to scale the overlay image to match the (auto-rotated) video dimensions,
-        # then overlay it on top.
-        # Using -loop 1 on the image input to loop it, and shortest=1 to end with video.
+        # The overlay already matches those dimensions when Pillow could resize it;
+        # otherwise scale2ref scales it to the (auto-rotated) video, then it's overlaid.
+        # The overlay is read as a single frame and repeated by the loop filter
+        # (ffmpeg's -loop 1 image input could end the output early), and
+        # shortest=1 ends it with the video.
+        # The merged file is the final output, so it gets the same encoder
+        # (hardware when one works) and quality settings as HEVC conversions.
+        encoder, encoder_args = video_utils.get_ffmpeg_h264_encoder()
+        if encoder == 'libx264':
+            encoder_args = ['-crf', '18', '-preset', OVERLAY_X264_PRESET]
+        # moov goes at the front so the merged clip can play while it's still
+        # loading; the date/GPS arguments already ask for the same
+        metadata_args = []
+        if Path(output_path).suffix.lower() in ('.mp4', '.mov', '.m4v'):
+            metadata_args = ['-movflags', '+faststart']
+        if date_obj is not None:
+            metadata_args = video_utils.ffmpeg_metadata_args(output_path, date_obj, latitude, longitude, timezone_offset)
+        output_args = [
+            '-map', '[outv]',
+            '-map', '1:a?',  # Copy audio from main video if it exists
+            '-c:a', 'copy',
+            '-c:v', encoder, *encoder_args,
+            *(['-threads', str(encoder_threads)] if encoder_threads else []),
+            *metadata_args,
+            str(output_path),
+        ]
         cmd = [
             'ffmpeg', '-y',
-            '-loop', '1',  # Loop the image input indefinitely
-            '-i', overlay_to_use,  # Use normalized overlay
+            *overlay_input,
             '-i', str(main_video_path),
             '-filter_complex', 
-            '[0:v][1:v]scale2ref[overlay_scaled][video];[video][overlay_scaled]overlay=0:0:shortest=1[outv]',
-            '-map', '[outv]',
-            '-map', '1:a?',  # Copy audio from main video if it exists
-            '-c:a', 'copy',
-            '-c:v', 'libx264', '-crf', '18', '-preset', 'veryfast',
-            str(output_path)
+            '[0:v]loop=loop=-1:size=1[overlay_still];'  # Repeat the image indefinitely
+            + ('[1:v][overlay_still]overlay=0:0:shortest=1[outv]' if overlay_fits else
+               '[overlay_still][1:v]scale2ref[overlay_scaled][video];'
+               '[video][overlay_scaled]overlay=0:0:shortest=1[outv]'),
+            *output_args,
         ]
 
-        logging.info(f"Running ffmpeg to merge video overlay: {' '.join(cmd)}")
+        if overlay_blank and probe and probe.get('codec') == 'h264' and not probe.get('rotation'):
+            # A fully transparent overlay changes no pixels. An upright H.264
+            # clip is already what the merge would produce, so remux it.
+            logging.info("Overlay is fully transparent; copying the video stream instead of re-encoding")
+            cmd = ['ffmpeg', '-y', '-i', str(main_video_path), '-map', '0:v:0', '-map', '0:a?', '-c', 'copy',
+                   *metadata_args, str(output_path)]
+            overlay_raw = None
+            use_gpu = False
+            encoder = None  # stream copy, no encoder session needed
+
+        gpu_cmd = None
+        if (use_gpu and probe and probe.get('rotation', 0) == 0
+                and probe.get('width') and probe.get('height') and _cuda_overlay_available()):
+            # Frames stay in GPU memory from decode to encode. Only the still
+            # overlay is scaled on the CPU before upload. Rotated clips are
+            # skipped because ffmpeg's autorotate filters can't take CUDA frames.
+            gpu_cmd = [
+                'ffmpeg', '-y',
+                *overlay_input,
+                '-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda',
+                '-i', str(main_video_path),
+                '-filter_complex',
+                "[0:v]loop=loop=-1:size=1,"
+                + ('' if overlay_fits else f"scale={probe['width']}:{probe['height']},")
+                + "format=yuva420p,hwupload_cuda[overlay_scaled];"
+                "[1:v][overlay_scaled]overlay_cuda=0:0:shortest=1[outv]",
+                *output_args,
+            ]
+
         logging.info(f"Input video: {main_video_path}")
-        logging.info(f"Overlay image: {overlay_image_path} (normalized: {overlay_to_use})")
+        logging.info(f"Overlay image: {overlay_image_path} (piped as raw RGBA: {overlay_raw is not None})")
         logging.info(f"Output path: {output_path}")
-        
-        # Run ffmpeg with Popen to capture real-time progress
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            creationflags=CREATE_NO_WINDOW
-        )
-        
-        # Read stderr for progress (ffmpeg writes progress to stderr)
-        stderr_output = []
-        try:
-            while True:
-                line = proc.stderr.readline()
-                if not line and proc.poll() is not None:
-                    break
-                if line:
-                    stderr_output.append(line)
-                    # Log progress lines (they contain 'time=' or 'frame=')
-                    if 'time=' in line or 'frame=' in line:
-                        logging.debug(f"ffmpeg progress: {line.strip()}")
-        except Exception as read_error:
-            logging.warning(f"Error reading ffmpeg output: {read_error}")
-        
-        # Wait for completion with timeout
-        try:
-            proc.wait(timeout=300)
-        except subprocess.TimeoutExpired:
-            proc.kill()
-            logging.error("ffmpeg overlay merge timed out after 300 seconds")
-            return False, "ffmpeg timeout"
-        
-        stderr_text = ''.join(stderr_output)
-        proc.returncode = proc.poll()
-        stderr_text = ''.join(stderr_output)
-        proc.returncode = proc.poll()
-        
-        if proc.returncode != 0:
-            logging.error(f"ffmpeg overlay merge failed with return code {proc.returncode}")
+
+        returncode = None
+        # Overlay pairs merge in parallel, so an NVENC encode holds one of
+        # the session slots for as long as ffmpeg runs
+        with video_utils.nvenc_session(encoder):
+            if gpu_cmd:
+                logging.info("Running ffmpeg to merge video overlay on the GPU: %s", gpu_cmd)
+                returncode, stderr_text = _run_ffmpeg_with_progress(gpu_cmd, input_data=overlay_raw)
+                if returncode != 0:
+                    logging.info(f"GPU overlay merge failed, retrying on the CPU: {stderr_text[-500:]}")
+            if returncode != 0:
+                logging.info("Running ffmpeg to merge video overlay: %s", cmd)
+                returncode, stderr_text = _run_ffmpeg_with_progress(cmd, input_data=overlay_raw)
+
+        if returncode != 0:
+            logging.error(f"ffmpeg overlay merge failed with return code {returncode}")
             logging.error(f"ffmpeg stderr: {stderr_text}")
             return False, stderr_text
 
-        # Verify output exists and has reasonable size
-        if os.path.exists(output_path):
-            output_size = os.path.getsize(output_path)
-            logging.info(f"Merged video created: {output_path} ({output_size} bytes)")
-            
-            if output_size > 1000:
-                # Additional verification: check duration of output video
-                try:
-                    verify_cmd = [
-                        'ffprobe', '-v', 'error',
-                        '-show_entries', 'format=duration',
-                        '-of', 'default=noprint_wrappers=1:nokey=1',
-                        str(output_path)
-                    ]
-                    verify_result = subprocess.run(
-                        verify_cmd, capture_output=True, text=True,
-                        timeout=10, creationflags=CREATE_NO_WINDOW
-                    )
-                    output_duration = float(verify_result.stdout.strip())
-                    logging.info(f"Output video duration: {output_duration} seconds")
-                    
-                    if video_duration and output_duration < (video_duration * 0.9):
-                        logging.warning(
-                            f"Output duration ({output_duration}s) is significantly shorter "
-                            f"than input ({video_duration}s) - possible merge issue"
-                        )
-                except Exception as verify_error:
-                    logging.debug(f"Could not verify output duration: {verify_error}")
-                
-                return True, str(output_path)
-            else:
-                logging.error(f"Output file too small: {output_size} bytes")
-                return False, f"ffmpeg produced file that is too small ({output_size} bytes)"
+        # Sanity-check the output without a probe: size plus a complete
+        # MP4 box layout, so a file ffmpeg left without its moov is caught
+        is_valid, validation_info = video_utils.validate_video_file(output_path, quick=True)
+        if not is_valid:
+            logging.error(f"Merged video failed validation: {validation_info['error']}")
+            return False, f"ffmpeg produced an invalid file: {validation_info['error']}"
+        logging.info(f"Merged video created: {output_path} ({os.path.getsize(output_path)} bytes)")
+
+        # Additional verification without a second probe: the output's
+        # mvhd box (at the front, thanks to faststart), or else
+        # ffmpeg's final progress line
+        output_duration = video_utils.read_mp4_duration(output_path)
+        if output_duration is None:
+            output_duration = _ffmpeg_output_duration(stderr_text)
+        if output_duration is not None:
+            logging.info(f"Output video duration: {output_duration} seconds")
+            if video_duration and output_duration < (video_duration * 0.9):
+                logging.warning(
+                    f"Output duration ({output_duration}s) is significantly shorter "
+                    f"than input ({video_duration}s) - possible merge issue"
+                )
         else:
-            logging.error("ffmpeg did not produce output file")
-            return False, "ffmpeg did not produce output file"
+            logging.debug("Could not verify output duration")
+
+        return True, str(output_path)
             
     except subprocess.TimeoutExpired:
         logging.error("ffmpeg overlay merge timed out after 300 seconds")
@@ -315,14 +600,6 @@ def merge_video_overlay(main_video_path, overlay_image_path, output_path):
     except Exception as e:
         logging.error(f"Error merging video overlay: {e}", exc_info=True)
         return False, str(e)
-    finally:
-        # Clean up normalized overlay file if it was created
-        if normalized_overlay and os.path.exists(normalized_overlay):
-            try:
-                os.remove(normalized_overlay)
-                logging.debug(f"Cleaned up normalized overlay: {normalized_overlay}")
-            except Exception as cleanup_error:
-                logging.debug(f"Could not remove normalized overlay: {cleanup_error}")
 
 
 def concat_video_segments(input_paths, output_path):
@@ -337,27 +614,14 @@ def concat_video_segments(input_paths, output_path):
     doesn't. Returns (True, output_path) on success, (False, error_message)
     otherwise.
     """
-    if shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None:
-        return False, "ffmpeg/ffprobe not found"
+    if not video_utils.check_ffmpeg() or not video_utils.can_probe():
+        return False, "ffmpeg or a video probe (PyAV/ffprobe) not found"
     if len(input_paths) < 2:
         return False, "need at least two segments to concat"
 
     try:
-        segments_have_audio = []
-        for p in input_paths:
-            try:
-                probe = subprocess.run(
-                    ['ffprobe', '-v', 'error', '-select_streams', 'a',
-                     '-show_entries', 'stream=codec_type',
-                     '-of', 'default=nw=1:nk=1', str(p)],
-                    capture_output=True, text=True, timeout=10,
-                    creationflags=CREATE_NO_WINDOW,
-                )
-                segments_have_audio.append('audio' in probe.stdout)
-            except Exception:
-                segments_have_audio.append(False)
-
-        all_have_audio = all(segments_have_audio)
+        probes = video_utils.probe_many(input_paths)
+        all_have_audio = all(probe and probe['has_audio'] for probe in probes.values())
 
         cmd = ['ffmpeg', '-y']
         for p in input_paths:
@@ -387,7 +651,7 @@ def concat_video_segments(input_paths, output_path):
         timeout = max(300, 60 * n)
         proc = subprocess.run(
             cmd, capture_output=True, text=True, timeout=timeout,
-            creationflags=CREATE_NO_WINDOW,
+            env=video_utils.SPAWN_ENV, creationflags=CREATE_NO_WINDOW,
         )
         if proc.returncode != 0:
             logging.error(f"ffmpeg concat failed: {proc.stderr[-500:]}")
@@ -404,7 +668,129 @@ def concat_video_segments(input_paths, output_path):
         return False, str(e)
 
 
-def process_zip_overlay(zip_path, output_dir, date_obj=None):
+def _rename_to_date_path(src, output_dir, date_name, suffix, existing):
+    """Move src to the first unused `date_name[_N]suffix` path in output_dir.
+
+    The name is claimed with a hardlink, which fails instead of overwriting
+    when another download thread created the same name since it was listed;
+    the next counter is tried then. Filesystems without hardlinks fall back
+    to a stat + os.replace.
+
+    Args:
+        src: Merged file to move (in output_dir)
+        output_dir: Directory the file will be renamed into
+        date_name: Timestamp stem, e.g. 20240101_120000
+        suffix: File extension including the dot
+        existing: Set of names known to be in output_dir; the chosen name is added
+
+    Returns:
+        Path the file now lives at
+    """
+    count = 0
+    while True:
+        new_name = f"{date_name}_{count}{suffix}" if count else f"{date_name}{suffix}"
+        count += 1
+        if new_name in existing:
+            continue
+        existing.add(new_name)
+        new_path = Path(output_dir) / new_name
+        try:
+            os.link(src, new_path)
+        except FileExistsError:
+            continue
+        except OSError:
+            if new_path.exists():
+                continue
+            os.replace(src, new_path)
+            return new_path
+        os.unlink(src)
+        return new_path
+
+
+def _merge_pair(base, main_file, overlay_file, temp_dir, streams, output_dir, date_obj, existing,
+                encoder_threads=None):
+    """Merge a single main/overlay pair from an extracted ZIP.
+
+    Args:
+        base: Shared name prefix of the pair (used for logging)
+        main_file: Archive name of the -main member
+        overlay_file: Archive name of the -overlay member
+        temp_dir: Directory video members were extracted to (None without video pairs)
+        streams: Dict of archive name -> BytesIO for in-memory image members
+        output_dir: Directory to save the merged output
+        date_obj: Optional datetime object for file naming
+        existing: Set of names already in output_dir, shared by all pairs
+        encoder_threads: Optional encoder thread cap for video merges
+
+    Returns:
+        Path of the merged file, or None on failure
+    """
+    ext = Path(main_file).suffix.lower()
+    is_video = ext in VIDEO_EXTENSIONS
+    output_name = Path(main_file).name.replace('-main', '-merged')
+    output_path = Path(output_dir) / output_name
+
+    logging.info(f"Processing pair '{base}': main={main_file}, overlay={overlay_file}")
+    logging.info(f"Media type: {'video' if is_video else 'image'}")
+    logging.info(f"Output will be: {output_path}")
+
+    if is_video:
+        main_path = temp_dir / main_file
+        overlay_path = temp_dir / overlay_file
+        logging.info(f"Starting video overlay merge for: {base}")
+        success, result = merge_video_overlay(str(main_path), str(overlay_path), str(output_path),
+                                              encoder_threads=encoder_threads)
+        if success:
+            logging.info(f"Video overlay merge successful for: {base}")
+            try:
+                if date_obj:
+                    ts = date_obj
+                else:
+                    try:
+                        ts = datetime.fromtimestamp(main_path.stat().st_mtime)
+                    except Exception:
+                        ts = datetime.now()
+                date_name = ts.strftime("%Y%m%d_%H%M%S")
+                # Pairs finish concurrently; claim a free name and move the file onto it
+                with _RENAME_LOCK:
+                    new_path = _rename_to_date_path(output_path, output_dir, date_name,
+                                                    output_path.suffix, existing)
+
+                try:
+                    main_path.unlink(missing_ok=True)
+                    overlay_path.unlink(missing_ok=True)
+                except Exception:
+                    pass
+                return str(new_path)
+
+            except Exception as rename_err:
+                logging.warning(f"Merged but could not rename video {base}: {rename_err}")
+                return str(output_path)
+        else:
+            logging.warning(f"Failed to merge video {base}: {result}")
+    else:
+        success, result = merge_images(streams[main_file], streams[overlay_file], str(output_path))
+        if success:
+            try:
+                # Image members never touch disk, so there is no extraction
+                # mtime to fall back on (it was always "now" anyway)
+                ts = date_obj or datetime.now()
+                date_name = ts.strftime("%Y%m%d_%H%M%S")
+                # Pairs finish concurrently; claim a free name and move the file onto it
+                with _RENAME_LOCK:
+                    new_path = _rename_to_date_path(output_path, output_dir, date_name,
+                                                    output_path.suffix, existing)
+                return str(new_path)
+
+            except Exception as rename_err:
+                logging.warning(f"Merged but could not rename image {base}: {rename_err}")
+                return str(output_path)
+        else:
+            logging.warning(f"Failed to merge image {base}: {result}")
+    return None
+
+
+def process_zip_overlay(zip_path, output_dir, date_obj=None, temp_parent=None):
     """Process ZIP files containing main and overlay media pairs.
     
     Snapchat exports videos with caption overlays as ZIP files containing:
@@ -417,6 +803,9 @@ def process_zip_overlay(zip_path, output_dir, date_obj=None):
         zip_path: Path to the ZIP file
         output_dir: Directory to save merged outputs
         date_obj: Optional datetime object for file naming and metadata
+        temp_parent: Optional directory to create the extraction folder in,
+            e.g. one scratch folder shared by a whole batch (default:
+            /dev/shm when it has room, else the system temp directory)
         
     Returns:
         List of merged file paths
@@ -426,124 +815,94 @@ def process_zip_overlay(zip_path, output_dir, date_obj=None):
     try:
         logging.info(f"Processing ZIP for overlays: {zip_path}")
         logging.info(f"Output directory: {output_dir}")
-        temp_dir = Path(tempfile.mkdtemp(prefix="zip_extract_"))
-        logging.info(f"Temporary extraction directory: {temp_dir}")
-
         with zipfile.ZipFile(zip_path, 'r') as z:
             namelist = [n for n in z.namelist() if not n.endswith('/')]
             logging.info(f"ZIP contains {len(namelist)} files: {namelist}")
-            z.extractall(temp_dir)
 
-            pattern_main = re.compile(r'(?P<base>.+)-main(?P<ext>\.[^.]+)$', re.IGNORECASE)
-            pattern_overlay = re.compile(r'(?P<base>.+)-overlay(?P<ext>\.[^.]+)$', re.IGNORECASE)
-
-            pairs = {}
+            pairs = defaultdict(dict)
             for member_name in namelist:
-                m_main = pattern_main.search(member_name)
-                m_overlay = pattern_overlay.search(member_name)
-                if m_main:
-                    base = m_main.group('base')
-                    if base not in pairs:
-                        pairs[base] = {}
-                    pairs[base]['main'] = member_name
-                elif m_overlay:
-                    base = m_overlay.group('base')
-                    if base not in pairs:
-                        pairs[base] = {}
-                    pairs[base]['overlay'] = member_name
-
+                stem, ext = os.path.splitext(member_name)
+                if not ext:
+                    continue
+                lowered = stem.lower()
+                if lowered.endswith('-main') and len(stem) > 5:
+                    pairs[stem[:-5]]['main'] = member_name
+                elif lowered.endswith('-overlay') and len(stem) > 8:
+                    pairs[stem[:-8]]['overlay'] = member_name
+
+            # Only complete pairs are merged, so only their members are read.
+            # ffmpeg needs real files for video pairs; image pairs are decoded
+            # by PIL straight from memory without a temp-file round trip.
+            to_extract = []
+            to_read = []
+            for files in pairs.values():
+                main_file = files.get('main')
+                overlay_file = files.get('overlay')
+                if not main_file or not overlay_file:
+                    continue
+                if Path(main_file).suffix.lower() in VIDEO_EXTENSIONS:
+                    to_extract += [main_file, overlay_file]
+                else:
+                    to_read += [main_file, overlay_file]
+
+            # Only video pairs need a scratch folder; image-only ZIPs skip it
+            in_ram = False
+            if to_extract:
+                if temp_parent is None:
+                    temp_parent = _scratch_parent(sum(z.getinfo(name).file_size for name in to_extract))
+                    in_ram = temp_parent is not None
+                temp_dir = Path(tempfile.mkdtemp(prefix="zip_extract_", dir=temp_parent))
+                logging.info(f"Temporary extraction directory: {temp_dir}")
+
+            workers = min(8, os.cpu_count() or 1, len(to_extract) + len(to_read))
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                try:
+                    _extract_members(z, to_extract, temp_dir, pool)
+                except OSError as e:
+                    # ZIPs from other download threads share /dev/shm, so the
+                    # free-space check can go stale; disk temp is the fallback
+                    if not (in_ram and e.errno == errno.ENOSPC):
+                        raise
+                    logging.warning(f"{_RAM_SCRATCH_DIR} is full, extracting to the system temp directory")
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    temp_dir = Path(tempfile.mkdtemp(prefix="zip_extract_"))
+                    _extract_members(z, to_extract, temp_dir, pool)
+                streams = dict(zip(to_read, pool.map(lambda name: io.BytesIO(z.read(name)), to_read)))
+
+        # One listing up front; collision checks are then set lookups
+        existing = set(os.listdir(output_dir))
+        tasks = []
         for base, files in pairs.items():
             main_file = files.get('main')
             overlay_file = files.get('overlay')
             if not main_file or not overlay_file:
                 logging.warning(f"Incomplete pair for base '{base}': main={main_file}, overlay={overlay_file}")
                 continue
-
-            main_path = temp_dir / main_file
-            overlay_path = temp_dir / overlay_file
-            ext = Path(main_file).suffix.lower()
-            is_video = ext in ['.mp4', '.mov', '.m4v', '.avi', '.mkv']
-            output_name = Path(main_file).name.replace('-main', '-merged')
-            output_path = Path(output_dir) / output_name
-
-            logging.info(f"Processing pair '{base}': main={main_file}, overlay={overlay_file}")
-            logging.info(f"Media type: {'video' if is_video else 'image'}")
-            logging.info(f"Output will be: {output_path}")
-
-            if is_video:
-                logging.info(f"Starting video overlay merge for: {base}")
-                success, result = merge_video_overlay(str(main_path), str(overlay_path), str(output_path))
-                if success:
-                    logging.info(f"Video overlay merge successful for: {base}")
-                    try:
-                        if date_obj:
-                            ts = date_obj
-                        else:
-                            try:
-                                ts = datetime.fromtimestamp(main_path.stat().st_mtime)
-                            except Exception:
-                                ts = datetime.now()
-                        date_name = ts.strftime("%Y%m%d_%H%M%S")
-                        new_name = f"{date_name}{output_path.suffix}"
-                        new_path = Path(output_dir) / new_name
-
-                        count = 1
-                        while new_path.exists():
-                            new_path = Path(output_dir) / f"{date_name}_{count}{output_path.suffix}"
-                            count += 1
-
-                        os.rename(output_path, new_path)
-                        merged_files.append(str(new_path))
-
-                        try:
-                            if main_path.exists():
-                                main_path.unlink()
-                            if overlay_path.exists():
-                                overlay_path.unlink()
-                        except Exception:
-                            pass
-
-                    except Exception as rename_err:
-                        logging.warning(f"Merged but could not rename video {base}: {rename_err}")
-                        merged_files.append(str(output_path))
-                else:
-                    logging.warning(f"Failed to merge video {base}: {result}")
-            else:
-                success, result = merge_images(str(main_path), str(overlay_path), str(output_path))
-                if success:
-                    try:
-                        if date_obj:
-                            ts = date_obj
-                        else:
-                            try:
-                                ts = datetime.fromtimestamp(main_path.stat().st_mtime)
-                            except Exception:
-                                ts = datetime.now()
-                        date_name = ts.strftime("%Y%m%d_%H%M%S")
-                        new_name = f"{date_name}{output_path.suffix}"
-                        new_path = Path(output_dir) / new_name
-
-                        count = 1
-                        while new_path.exists():
-                            new_path = Path(output_dir) / f"{date_name}_{count}{output_path.suffix}"
-                            count += 1
-
-                        os.rename(output_path, new_path)
-                        merged_files.append(str(new_path))
-
-                        try:
-                            if main_path.exists():
-                                main_path.unlink()
-                            if overlay_path.exists():
-                                overlay_path.unlink()
-                        except Exception:
-                            pass
-
-                    except Exception as rename_err:
-                        logging.warning(f"Merged but could not rename image {base}: {rename_err}")
-                        merged_files.append(str(output_path))
-                else:
-                    logging.warning(f"Failed to merge image {base}: {result}")
+            tasks.append((base, main_file, overlay_file, temp_dir, streams, output_dir, date_obj, existing))
+
+        # Pairs are independent. PIL releases the GIL while compositing and
+        # ffmpeg runs out of process, so threads are enough to use every core.
+        # ffmpeg threads internally, so video pairs get their own pool with
+        # half as many workers and never hold image pairs back.
+        if len(tasks) > 1:
+            cpus = os.cpu_count() or 2
+            video_count = sum(1 for t in tasks if Path(t[1]).suffix.lower() in VIDEO_EXTENSIONS)
+            video_workers = max(1, min(cpus // 2, video_count))
+            # Concurrent encodes split the cores instead of each spawning one
+            # thread per core
+            encoder_threads = max(1, cpus // video_workers) if video_workers > 1 else None
+            with ThreadPoolExecutor(max_workers=cpus) as image_pool, \
+                    ThreadPoolExecutor(max_workers=video_workers) as video_pool:
+                futures = [
+                    video_pool.submit(_merge_pair, *t, encoder_threads)
+                    if Path(t[1]).suffix.lower() in VIDEO_EXTENSIONS
+                    else image_pool.submit(_merge_pair, *t)
+                    for t in tasks
+                ]
+                results = [f.result() for f in futures]
+        else:
+            results = [_merge_pair(*t) for t in tasks]
+        merged_files = [r for r in results if r]
 
         return merged_files
 